@@ -0,0 +1,221 @@
+#!/usr/bin/python
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+try:
+    from urllib.request import urlopen, Request
+except ImportError:
+    from urllib2 import urlopen, Request
+
+# Offline benchmark of rbk_concurrent_nas_backup.py and rbk_nas_backup.py against mock_rubrik.py.
+# For each inventory size it starts a mock cluster, runs the concurrent script over every share and
+# rbk_nas_backup.py over a few shares, and reports the inventory load and queue generation time,
+# makespan, peak memory and API calls of each run.  Timings come from the scripts' own
+# --metrics_json events and API call counts from the mock, so the numbers match a real run's.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+def usage():
+    sys.stderr.write("Usage: bench.py [-h] [--sizes=n,n,...] [--max_jobs=n] [--single_runs=n] [--job_time=secs] [--queue_time=secs] [--latency=secs] [--fail_rate=f] [--job_fail_rate=f] [--fileset_ratio=f] [--flush] [--args='...'] [--out=file]\n")
+    sys.stderr.write("-h | --help : Prints this message\n")
+    sys.stderr.write("--sizes : Inventory sizes (number of shares) to run [default: 1000,10000,50000]\n")
+    sys.stderr.write("--max_jobs : -m passed to rbk_concurrent_nas_backup.py [default: 200]\n")
+    sys.stderr.write("--single_runs : Number of rbk_nas_backup.py runs at each size [default: 3]\n")
+    sys.stderr.write("--job_time : Average mock backup run time in seconds [default: 2]\n")
+    sys.stderr.write("--queue_time : Time a mock backup stays QUEUED in seconds [default: 0.5]\n")
+    sys.stderr.write("--latency : Average mock API latency in seconds [default: 0.005]\n")
+    sys.stderr.write("--fail_rate : Fraction of mock API calls that fail with a 503 [default: 0]\n")
+    sys.stderr.write("--job_fail_rate : Fraction of mock backups that fail [default: 0]\n")
+    sys.stderr.write("--fileset_ratio : Fraction of shares that already have a fileset [default: 0.9]\n")
+    sys.stderr.write("--flush : Pass -F to rbk_concurrent_nas_backup.py to skip the restart checks\n")
+    sys.stderr.write("--args : Extra options for rbk_concurrent_nas_backup.py, e.g. --args='--stream --host_jobs=4'\n")
+    sys.stderr.write("--out : Also write the results to this file as JSON\n")
+    exit(0)
+
+def start_mock(shares):
+    cmd = [sys.executable, os.path.join(BENCH_DIR, 'mock_rubrik.py'), '--port=0', '--shares=' + str(shares),
+           '--job_time=' + str(job_time), '--queue_time=' + str(queue_time), '--latency=' + str(latency),
+           '--fail_rate=' + str(fail_rate), '--job_fail_rate=' + str(job_fail_rate), '--fileset_ratio=' + str(fileset_ratio)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    line = proc.stdout.readline().decode('utf-8').strip()
+    if not line.startswith("Listening on "):
+        proc.kill()
+        sys.stderr.write("Mock cluster didn't start: " + line + "\n")
+        exit(1)
+    return(proc, line[len("Listening on "):])
+
+def mock_call(url, path, method='GET'):
+    req = Request(url + path, data=b'' if method == 'POST' else None)
+    return(json.loads(urlopen(req).read().decode('utf-8')))
+
+def run_script(cmd, work_dir, log_name):
+    start = time.time()
+    with open(os.path.join(work_dir, log_name), 'w') as log:
+        proc = subprocess.Popen(cmd, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+        (pid, status, rusage) = os.wait4(proc.pid, 0)
+    proc.returncode = status
+    peak = rusage.ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return({'wall': time.time() - start, 'rc': status >> 8, 'peak_mb': round(peak / 1048576, 1)})
+
+def read_events(events_file):
+    events = []
+    if not os.path.isfile(events_file):
+        return(events)
+    with open(events_file) as fp:
+        for line in fp:
+            events.append(json.loads(line))
+    return(events)
+
+def event_times(events):
+    first = {}
+    last = {}
+    for e in events:
+        first.setdefault(e['event'], e)
+        last[e['event']] = e
+    return(first, last)
+
+def bench_concurrent(url, shares, work_dir):
+    infile = os.path.join(work_dir, 'shares.txt')
+    with open(infile, 'w') as fp:
+        for i in range(shares):
+            fp.write("nas%04d,/export/share%06d,Gold\n" % (i // 50, i))
+    events_file = os.path.join(work_dir, 'concurrent.jsonl')
+    cmd = [sys.executable, os.path.join(REPO_DIR, 'rbk_concurrent_nas_backup.py'), '-t', 'bench', '-m', str(max_jobs), '-f', 'bench_fst',
+           '--poll_min=1', '--poll_max=30', '--metrics_json=' + events_file]
+    if flush:
+        cmd.append('-F')
+    cmd += extra_args + [infile, url]
+    mock_call(url, '/mock/reset', 'POST')
+    result = run_script(cmd, work_dir, 'concurrent.log')
+    (first, last) = event_times(read_events(events_file))
+    result['api_calls'] = mock_call(url, '/mock/stats')['total']
+    if 'inventory' in last:
+        result['inventory'] = last['inventory']['seconds']
+    if 'inventory' in last and 'job_launch' in first:
+        result['queue_gen'] = first['job_launch']['ts'] - last['inventory']['ts']
+    if 'run_start' in first and 'run_end' in last:
+        result['makespan'] = last['run_end']['ts'] - first['run_start']['ts']
+        result['succeeded'] = last['run_end']['succeeded']
+        result['failed'] = last['run_end']['failed']
+    return(result)
+
+def bench_single(url, shares, work_dir):
+    results = []
+    for n in range(single_runs):
+        i = shares - 1 - n * (shares // max(single_runs, 1))
+        events_file = os.path.join(work_dir, 'single.jsonl')
+        if os.path.isfile(events_file):
+            os.remove(events_file)
+        cmd = [sys.executable, os.path.join(REPO_DIR, 'rbk_nas_backup.py'), '-b', "nas%04d:/export/share%06d" % (i // 50, i), '-f', 'bench_fst',
+               '-s', 'Gold', '-c', 'bench:bench', '--poll_min=1', '--metrics_json=' + events_file, url]
+        mock_call(url, '/mock/reset', 'POST')
+        result = run_script(cmd, work_dir, 'single.log')
+        (first, last) = event_times(read_events(events_file))
+        result['api_calls'] = mock_call(url, '/mock/stats')['total']
+        if 'inventory' in last:
+            result['inventory'] = last['inventory']['seconds']
+        if 'run_start' in first and 'run_end' in last:
+            result['makespan'] = last['run_end']['ts'] - first['run_start']['ts']
+        results.append(result)
+    if not results:
+        return({})
+    summary = {'runs': len(results), 'rc': max(r['rc'] for r in results), 'peak_mb': max(r['peak_mb'] for r in results)}
+    for key in ('wall', 'api_calls', 'inventory', 'makespan'):
+        values = [r[key] for r in results if key in r]
+        if values:
+            summary[key] = sum(values) / len(values)
+    return(summary)
+
+def fmt(value, digits=1):
+    if value is None:
+        return("-")
+    if isinstance(value, float):
+        return(str(round(value, digits)))
+    return(str(value))
+
+def print_results(results):
+    print("%-8s %-11s %10s %10s %10s %10s %10s %10s %4s" % ("shares", "script", "inventory", "queue_gen", "makespan", "wall", "peak_mb",
+                                                             "api_calls", "rc"))
+    for r in results:
+        for (name, data) in (('concurrent', r['concurrent']), ('single', r['single'])):
+            if not data:
+                continue
+            print("%-8s %-11s %10s %10s %10s %10s %10s %10s %4s" % (r['shares'], name, fmt(data.get('inventory'), 3), fmt(data.get('queue_gen'), 3),
+                                                                     fmt(data.get('makespan')), fmt(data.get('wall')), fmt(data.get('peak_mb')),
+                                                                     fmt(data.get('api_calls'), 0), fmt(data.get('rc'))))
+    return
+
+if __name__ == "__main__":
+    sizes = [1000, 10000, 50000]
+    max_jobs = 200
+    single_runs = 3
+    job_time = 2.0
+    queue_time = 0.5
+    latency = 0.005
+    fail_rate = 0.0
+    job_fail_rate = 0.0
+    fileset_ratio = 0.9
+    flush = False
+    extra_args = []
+    out_file = ""
+
+    optlist, args = getopt.getopt(sys.argv[1:], 'h', ['help', 'sizes=', 'max_jobs=', 'single_runs=', 'job_time=', 'queue_time=', 'latency=',
+                                                      'fail_rate=', 'job_fail_rate=', 'fileset_ratio=', 'flush', 'args=', 'out='])
+    for opt, a in optlist:
+        if opt in ('-h', '--help'):
+            usage()
+        if opt == '--sizes':
+            sizes = [int(s) for s in a.split(',') if s]
+        if opt == '--max_jobs':
+            max_jobs = int(a)
+        if opt == '--single_runs':
+            single_runs = int(a)
+        if opt == '--job_time':
+            job_time = float(a)
+        if opt == '--queue_time':
+            queue_time = float(a)
+        if opt == '--latency':
+            latency = float(a)
+        if opt == '--fail_rate':
+            fail_rate = float(a)
+        if opt == '--job_fail_rate':
+            job_fail_rate = float(a)
+        if opt == '--fileset_ratio':
+            fileset_ratio = float(a)
+        if opt == '--flush':
+            flush = True
+        if opt == '--args':
+            extra_args = a.split()
+        if opt == '--out':
+            out_file = a
+    results = []
+    for shares in sizes:
+        work_dir = tempfile.mkdtemp(prefix='rbk_bench_')
+        (mock, url) = start_mock(shares)
+        try:
+            print("Benchmarking " + str(shares) + " shares against " + url)
+            sys.stdout.flush()
+            results.append({'shares': shares, 'concurrent': bench_concurrent(url, shares, work_dir),
+                            'single': bench_single(url, shares, work_dir)})
+        finally:
+            mock.kill()
+            mock.wait()
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print('')
+    print_results(results)
+    if out_file:
+        with open(out_file, 'w') as fp:
+            json.dump({'time': time.time(), 'options': {'max_jobs': max_jobs, 'job_time': job_time, 'queue_time': queue_time, 'latency': latency,
+                                                        'fail_rate': fail_rate, 'job_fail_rate': job_fail_rate, 'fileset_ratio': fileset_ratio,
+                                                        'flush': flush, 'args': extra_args},
+                       'results': results}, fp, indent=2)
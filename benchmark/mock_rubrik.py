@@ -0,0 +1,283 @@
+#!/usr/bin/python
+from __future__ import print_function
+from __future__ import division
+import sys
+import json
+import time
+import random
+import getopt
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+# Simulated Rubrik REST API for benchmarking rbk_nas_backup.py and rbk_concurrent_nas_backup.py
+# without a cluster.  It serves the share, SLA, fileset and fileset template inventory, fileset
+# creation, on demand backups, job status and /event/latest over plain HTTP, with a configurable
+# inventory size, per-call latency, API failure rate, job run time and job failure rate.  Point a
+# script at it with http://host:port in place of the cluster name.  GET /mock/stats returns the
+# number of calls per endpoint and POST /mock/reset clears them.
+
+def usage():
+    sys.stderr.write("Usage: mock_rubrik.py [-h] [--port=n] [--shares=n] [--shares_per_host=n] [--fileset_ratio=f] [--latency=secs] [--fail_rate=f] [--job_time=secs] [--queue_time=secs] [--job_fail_rate=f] [--page_max=n] [--seed=n]\n")
+    sys.stderr.write("-h | --help : Prints this message\n")
+    sys.stderr.write("--port : Port to listen on.  0 picks a free one [default: 8080]\n")
+    sys.stderr.write("--shares : Number of NAS shares in the inventory [default: 1000]\n")
+    sys.stderr.write("--shares_per_host : Number of shares on each NAS host [default: 50]\n")
+    sys.stderr.write("--fileset_ratio : Fraction of shares that already have a fileset from the bench template [default: 0.9]\n")
+    sys.stderr.write("--latency : Average time taken by each API call in seconds [default: 0.005]\n")
+    sys.stderr.write("--fail_rate : Fraction of API calls answered with a 503 [default: 0]\n")
+    sys.stderr.write("--job_time : Average backup run time in seconds [default: 2]\n")
+    sys.stderr.write("--queue_time : Time a backup stays QUEUED before it runs in seconds [default: 0.5]\n")
+    sys.stderr.write("--job_fail_rate : Fraction of backups that end FAILED [default: 0]\n")
+    sys.stderr.write("--page_max : Most objects returned by one inventory call that sets a limit [default: 1000]\n")
+    sys.stderr.write("--seed : Random seed [default: 1]\n")
+    exit(0)
+
+SLAS = ('Gold', 'Silver', 'Bronze')
+TEMPLATE_NAME = "bench_fst"
+TEMPLATE_ID = "FilesetTemplate:::bench"
+
+def build_inventory(shares, shares_per_host, fileset_ratio):
+    state = {'lock': threading.Lock(), 'shares': [], 'filesets': [], 'fs_by_share': {}, 'fs_by_id': {}, 'jobs': {}, 'next_job': 1,
+             'next_fs': 1, 'calls': {}}
+    state['slas'] = [{'id': "SLA:::" + name.lower(), 'name': name} for name in SLAS]
+    state['templates'] = [{'id': TEMPLATE_ID, 'name': TEMPLATE_NAME, 'shareType': "NFS"}]
+    for i in range(shares):
+        state['shares'].append({'id': "HostShare:::" + str(i), 'hostname': "nas%04d" % (i // shares_per_host),
+                                'exportPoint': "/export/share%06d" % i, 'shareType': "NFS"})
+    for share in state['shares']:
+        if random.random() < fileset_ratio:
+            add_fileset(state, share['id'])
+    return(state)
+
+def add_fileset(state, share_id):
+    fs = {'id': "Fileset:::" + str(state['next_fs']), 'shareId': share_id, 'templateId': TEMPLATE_ID, 'name': TEMPLATE_NAME,
+          'configuredSlaDomainId': state['slas'][0]['id'], 'configuredSlaDomainName': state['slas'][0]['name']}
+    state['next_fs'] += 1
+    state['filesets'].append(fs)
+    state['fs_by_share'][share_id] = fs
+    state['fs_by_id'][fs['id']] = fs
+    return(fs)
+
+def page(items, query):
+    limit = len(items)
+    if 'limit' in query:
+        limit = min(int(query['limit'][0]), page_max)
+    offset = int(query.get('offset', [0])[0])
+    data = items[offset:offset + limit]
+    return({'data': data, 'total': len(items), 'hasMore': offset + len(data) < len(items)})
+
+def api_time(t):
+    return(time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + ".000Z")
+
+def job_status(job):
+    now = time.time()
+    if now < job['start'] + queue_time:
+        return({'id': job['id'], 'status': "QUEUED"})
+    run_time = now - job['start'] - queue_time
+    if run_time < job['duration']:
+        return({'id': job['id'], 'status': "RUNNING", 'progress': round(100 * run_time / job['duration'], 1)})
+    status = "SUCCEEDED"
+    if job['fail']:
+        status = "FAILED"
+    return({'id': job['id'], 'status': status, 'progress': 100, 'startTime': api_time(job['start'] + queue_time),
+            'endTime': api_time(job['start'] + queue_time + job['duration'])})
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def reply(self, code, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for (k, v) in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def count(self, key):
+        with state['lock']:
+            state['calls'][key] = state['calls'].get(key, 0) + 1
+
+    def simulate(self, key):
+        self.count(key)
+        if latency:
+            time.sleep(random.uniform(0.5, 1.5) * latency)
+        if fail_rate and random.random() < fail_rate:
+            self.reply(503, {'message': "Simulated failure"}, {'Retry-After': "0"})
+            return(False)
+        return(True)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            return(None)
+        return(json.loads(self.rfile.read(length).decode('utf-8')))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path
+        if path == '/mock/stats':
+            with state['lock']:
+                calls = dict(state['calls'])
+            self.reply(200, {'calls': calls, 'total': sum(calls.values()), 'jobs': len(state['jobs'])})
+            return
+        parts = path.split('/')
+        if len(parts) < 4 or parts[1] != 'api':
+            self.reply(404, {'message': "Not found"})
+            return
+        endpoint = "/" + "/".join(parts[3:])
+        if endpoint.startswith('/fileset/request/'):
+            key = "GET /fileset/request"
+        else:
+            key = "GET " + endpoint
+        if not self.simulate(key):
+            return
+        if endpoint == '/cluster/me':
+            self.reply(200, {'id': "mock", 'version': "5.3.0"})
+        elif endpoint == '/host/share':
+            shares = state['shares']
+            if 'hostname' in query:
+                shares = [s for s in shares if s['hostname'] == query['hostname'][0]]
+            self.reply(200, page(shares, query))
+        elif endpoint == '/sla_domain':
+            slas = state['slas']
+            if 'name' in query:
+                slas = [s for s in slas if s['name'] == query['name'][0]]
+            self.reply(200, page(slas, query))
+        elif endpoint == '/fileset_template':
+            templates = state['templates']
+            if 'name' in query:
+                templates = [t for t in templates if t['name'] == query['name'][0]]
+            self.reply(200, page(templates, query))
+        elif endpoint == '/fileset':
+            with state['lock']:
+                filesets = list(state['filesets'])
+            if 'share_id' in query:
+                fs = state['fs_by_share'].get(query['share_id'][0])
+                filesets = [fs] if fs else []
+            if 'template_id' in query:
+                filesets = [f for f in filesets if f['templateId'] == query['template_id'][0]]
+            if 'name' in query:
+                filesets = [f for f in filesets if f['name'] == query['name'][0]]
+            self.reply(200, page(filesets, query))
+        elif endpoint.startswith('/fileset/request/'):
+            job = state['jobs'].get(parts[-1])
+            if not job:
+                self.reply(404, {'message': "No such job"})
+            else:
+                self.reply(200, job_status(job))
+        elif endpoint == '/event/latest':
+            self.reply(200, {'data': [], 'total': 0, 'hasMore': False})
+        else:
+            self.reply(404, {'message': "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        path = url.path
+        if path == '/mock/reset':
+            with state['lock']:
+                state['calls'] = {}
+            self.reply(200, {})
+            return
+        parts = path.split('/')
+        if len(parts) < 4 or parts[1] != 'api':
+            self.reply(404, {'message': "Not found"})
+            return
+        endpoint = "/" + "/".join(parts[3:])
+        body = self.read_body()
+        if endpoint.endswith('/snapshot'):
+            key = "POST /fileset/snapshot"
+        else:
+            key = "POST " + endpoint
+        if not self.simulate(key):
+            return
+        if endpoint == '/fileset/bulk':
+            created = []
+            with state['lock']:
+                for item in body:
+                    fs = state['fs_by_share'].get(item['shareId']) or add_fileset(state, item['shareId'])
+                    created.append({'id': fs['id'], 'shareId': fs['shareId'], 'templateId': fs['templateId']})
+            self.reply(201, {'data': created, 'total': len(created), 'hasMore': False})
+        elif endpoint == '/fileset':
+            with state['lock']:
+                fs = state['fs_by_share'].get(body['shareId']) or add_fileset(state, body['shareId'])
+            self.reply(201, fs)
+        elif endpoint.startswith('/fileset/') and endpoint.endswith('/snapshot') and parts[-2] not in state['fs_by_id']:
+            self.reply(404, {'message': "No such fileset"})
+        elif endpoint.startswith('/fileset/') and endpoint.endswith('/snapshot'):
+            with state['lock']:
+                job_id = "MOCK_BACKUP_" + str(state['next_job'])
+                state['next_job'] += 1
+                state['jobs'][job_id] = {'id': job_id, 'start': time.time(), 'duration': random.uniform(0.5, 1.5) * job_time,
+                                         'fail': random.random() < job_fail_rate}
+            href = "http://" + self.headers.get('Host', "localhost") + "/api/v1/fileset/request/" + job_id
+            self.reply(202, {'id': job_id, 'status': "QUEUED", 'links': [{'href': href, 'rel': "self"}]})
+        else:
+            self.reply(404, {'message': "Not found"})
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+if __name__ == "__main__":
+    port = 8080
+    shares = 1000
+    shares_per_host = 50
+    fileset_ratio = 0.9
+    latency = 0.005
+    fail_rate = 0.0
+    job_time = 2.0
+    queue_time = 0.5
+    job_fail_rate = 0.0
+    page_max = 1000
+    seed = 1
+
+    optlist, args = getopt.getopt(sys.argv[1:], 'h', ['help', 'port=', 'shares=', 'shares_per_host=', 'fileset_ratio=', 'latency=',
+                                                      'fail_rate=', 'job_time=', 'queue_time=', 'job_fail_rate=', 'page_max=', 'seed='])
+    for opt, a in optlist:
+        if opt in ('-h', '--help'):
+            usage()
+        if opt == '--port':
+            port = int(a)
+        if opt == '--shares':
+            shares = int(a)
+        if opt == '--shares_per_host':
+            shares_per_host = int(a)
+        if opt == '--fileset_ratio':
+            fileset_ratio = float(a)
+        if opt == '--latency':
+            latency = float(a)
+        if opt == '--fail_rate':
+            fail_rate = float(a)
+        if opt == '--job_time':
+            job_time = float(a)
+        if opt == '--queue_time':
+            queue_time = float(a)
+        if opt == '--job_fail_rate':
+            job_fail_rate = float(a)
+        if opt == '--page_max':
+            page_max = int(a)
+        if opt == '--seed':
+            seed = int(a)
+    random.seed(seed)
+    state = build_inventory(shares, shares_per_host, fileset_ratio)
+    server = MockServer(('127.0.0.1', port), MockHandler)
+    print("Listening on http://127.0.0.1:" + str(server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,197 @@
+import time
+import random
+import threading
+
+# Pooled, keep-alive connection to the Rubrik REST API shared by rbk_nas_backup.py and
+# rbk_concurrent_nas_backup.py.  It takes the same get/post calls as rubrik_cdm.Connect but keeps one
+# requests session with a connection pool sized to the number of concurrent callers, so the many small
+# status and event calls reuse connections instead of doing a TLS handshake each.  Every call is
+# counted and its latency recorded in a histogram so a run can report how long it spent on the network.
+#
+# Calls that fail with a timeout, a connection error or a 429/502/503/504 are retried with jittered
+# exponential backoff, honouring Retry-After, until the per-call retry count or the retry budget is used
+# up.  The budget is a token bucket holding retry_budget retries that refills at that many per
+# budget_window seconds, so a long running service keeps retrying transient errors while a storm of
+# them can't turn into a flood of retries.  A POST is only retried when it can't have reached the
+# cluster (a connect timeout) or the cluster answered 429/503, never after a read timeout, a dropped
+# connection or a 502/504, since the cluster may have acted on it.  After circuit_threshold failures in
+# a row the circuit opens for circuit_cooldown seconds and every call fails fast with CircuitOpenError
+# so callers can back off instead of piling on.
+#
+# requests (and urllib3) are only imported when the first Connect is made, so a script can check its
+# options and input without paying for them or needing them installed.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RETRY_STATUS = (429, 502, 503, 504)
+UNKNOWN_STATUS = (502, 504)
+requests = None
+HTTPAdapter = None
+
+def load_requests():
+    global requests, HTTPAdapter
+    if requests is None:
+        import urllib3
+        import requests
+        from requests.adapters import HTTPAdapter
+        urllib3.disable_warnings()
+    return
+
+class CircuitOpenError(Exception):
+    pass
+
+def outcome_unknown(e):
+    if error_status(e) in UNKNOWN_STATUS:
+        return(True)
+    if requests is None or isinstance(e, requests.exceptions.ConnectTimeout):
+        return(False)
+    return(isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)))
+
+def error_status(e):
+    response = getattr(e, 'response', None)
+    if response is None:
+        return(0)
+    return(response.status_code)
+
+class Connect(object):
+
+    def __init__(self, node, user="", password="", api_token="", pool_size=10, retries=4, retry_budget=500, budget_window=3600,
+                 backoff_base=1, backoff_max=60, circuit_threshold=10, circuit_cooldown=60):
+        load_requests()
+        self.node = node
+        if "://" in node:
+            self.base_url = node.rstrip('/') + "/api/"
+        else:
+            self.base_url = "https://" + node + "/api/"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = False
+        self.session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate',
+                                     'User-Agent': 'rbk_nas_backup'})
+        if api_token:
+            self.session.headers['Authorization'] = "Bearer " + api_token
+        else:
+            self.session.auth = (user, password)
+        self.retries = retries
+        self.retry_budget = retry_budget
+        self.budget_window = budget_window
+        self.budget = float(retry_budget)
+        self.budget_time = time.time()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_threshold = circuit_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self.failures = 0
+        self.circuit_until = 0
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'errors': 0, 'retries': 0, 'time': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+        self.latency = 0.0
+
+    def get(self, api_version, api_endpoint, timeout=15):
+        return(self.call('GET', api_version, api_endpoint, None, timeout))
+
+    def post(self, api_version, api_endpoint, config, timeout=15):
+        return(self.call('POST', api_version, api_endpoint, config, timeout))
+
+    def cluster_version(self):
+        return(self.get('v1', '/cluster/me')['version'])
+
+    def call(self, method, api_version, api_endpoint, config, timeout):
+        url = self.base_url + api_version + api_endpoint
+        attempt = 0
+        while True:
+            if self.circuit_open():
+                raise CircuitOpenError("Too many failed calls to " + self.node + ". Backing off")
+            retry_after = 0
+            start = time.time()
+            try:
+                resp = self.session.request(method, url, json=config, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                self.record(time.time() - start, False)
+                self.failed()
+                if not self.retryable_error(method, e) or not self.take_retry(attempt):
+                    raise
+            else:
+                self.record(time.time() - start, resp.status_code < 400)
+                if resp.status_code < 400:
+                    self.succeeded()
+                    if not resp.content:
+                        return({})
+                    return(resp.json())
+                if resp.status_code not in RETRY_STATUS or (method == 'POST' and resp.status_code in UNKNOWN_STATUS):
+                    resp.raise_for_status()
+                self.failed()
+                if not self.take_retry(attempt):
+                    resp.raise_for_status()
+                try:
+                    retry_after = float(resp.headers.get('Retry-After', 0))
+                except ValueError:
+                    retry_after = 0
+            time.sleep(max(retry_after, random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))))
+            attempt += 1
+
+    def retryable_error(self, method, e):
+        if method == 'POST':
+            return(isinstance(e, requests.exceptions.ConnectTimeout))
+        return(isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)))
+
+    def take_retry(self, attempt):
+        with self.lock:
+            now = time.time()
+            self.budget = min(self.retry_budget, self.budget + (now - self.budget_time) * self.retry_budget / self.budget_window)
+            self.budget_time = now
+            if attempt >= self.retries or self.budget < 1:
+                return(False)
+            self.budget -= 1
+            self.stats['retries'] += 1
+            return(True)
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.circuit_threshold:
+                self.circuit_until = time.time() + self.circuit_cooldown
+                self.failures = 0
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+
+    def circuit_open(self):
+        return(time.time() < self.circuit_until)
+
+    def record(self, elapsed, ok):
+        bucket = len(LATENCY_BUCKETS)
+        for i in range(len(LATENCY_BUCKETS)):
+            if elapsed <= LATENCY_BUCKETS[i]:
+                bucket = i
+                break
+        with self.lock:
+            self.stats['calls'] += 1
+            self.stats['time'] += elapsed
+            self.stats['buckets'][bucket] += 1
+            self.latency = 0.8 * self.latency + 0.2 * elapsed
+            if not ok:
+                self.stats['errors'] += 1
+
+    def recent_latency(self):
+        return(self.latency)
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['buckets'] = list(self.stats['buckets'])
+        return(stats)
+
+    def summary(self):
+        stats = self.snapshot()
+        lines = ["API calls: " + str(stats['calls']) + " (" + str(stats['errors']) + " errors, " + str(stats['retries']) + " retries) " +
+                 str(round(stats['time'], 1)) + "s total"]
+        for i in range(len(stats['buckets'])):
+            if i < len(LATENCY_BUCKETS):
+                label = "<= " + str(LATENCY_BUCKETS[i]) + "s"
+            else:
+                label = " > " + str(LATENCY_BUCKETS[-1]) + "s"
+            lines.append("\t" + label + ": " + str(stats['buckets'][i]))
+        return(lines)
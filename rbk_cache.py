@@ -0,0 +1,72 @@
+import os
+import json
+import time
+
+# Small on-disk cache of Rubrik inventory calls (/host/share, /sla_domain, /fileset) shared by
+# rbk_nas_backup.py and rbk_concurrent_nas_backup.py.  Entries are keyed by "api:endpoint" and
+# expire individually so only the stale collections are pulled again.
+
+def cache_file_name(cluster):
+    name = cluster
+    for c in (':', '/', '\\'):
+        name = name.replace(c, '_')
+    return(".rbk_cache_" + name + ".json")
+
+def load_cache(cluster, ttl, refresh=False):
+    cache = {'file': cache_file_name(cluster), 'ttl': ttl * 60, 'enabled': ttl > 0, 'entries': {}}
+    if not cache['enabled'] or refresh:
+        return(cache)
+    try:
+        with open(cache['file']) as fp:
+            cache['entries'] = json.load(fp)
+    except (IOError, OSError, ValueError):
+        cache['entries'] = {}
+    return(cache)
+
+def cached_entries(cluster):
+    try:
+        with open(cache_file_name(cluster)) as fp:
+            return(json.load(fp))
+    except (IOError, OSError, ValueError):
+        return({})
+
+def save_cache(cache):
+    if not cache['enabled']:
+        return
+    now = time.time()
+    for key in list(cache['entries']):
+        if now - cache['entries'][key]['time'] > cache['ttl']:
+            del cache['entries'][key]
+    tmp_file = cache['file'] + ".tmp"
+    with open(tmp_file, "w") as fp:
+        json.dump(cache['entries'], fp, separators=(',', ':'))
+    try:
+        os.rename(tmp_file, cache['file'])
+    except OSError:
+        os.remove(cache['file'])
+        os.rename(tmp_file, cache['file'])
+    return
+
+def cache_get(cache, key):
+    if not cache['enabled']:
+        return(None)
+    entry = cache['entries'].get(key)
+    if entry is None or time.time() - entry['time'] > cache['ttl']:
+        return(None)
+    return(entry['data'])
+
+def cache_put(cache, key, data):
+    if not cache['enabled']:
+        return
+    cache['entries'][key] = {'time': time.time(), 'data': data}
+    save_cache(cache)
+    return
+
+def cache_invalidate(cache, prefix):
+    if not cache['enabled']:
+        return
+    for key in list(cache['entries']):
+        if key == prefix or key.startswith(prefix + "?"):
+            del cache['entries'][key]
+    save_cache(cache)
+    return
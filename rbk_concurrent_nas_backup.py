@@ -7,34 +7,100 @@ import getopt
 import getpass
 from datetime import datetime
 import operator
-import urllib3
-urllib3.disable_warnings()
-import rubrik_cdm
-from os import path
+import heapq
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from multiprocessing.pool import ThreadPool
+import rbk_api
+import rbk_cache
+import rbk_poll
+import rbk_journal
+import rbk_hooks
+import rbk_metrics
+import rbk_plan
+import rbk_profile
+import signal
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 
 
 
+EPOCH = datetime.strptime("1970-01-01T00:00:00", "%Y-%m-%dT%H:%M:%S")
+VALIDATE_LINES = 50
+output = threading.local()
+
 def usage():
-    sys.stderr.write("Usage: rbk_concurrent_nas_backup.py [-hDdSF] [-c creds] [-t token] [-m jobs] [-s sla] [-n nas_host] [-f fileset] [-r minutes] file rubrik\n")
+    sys.stderr.write("Usage: rbk_concurrent_nas_backup.py [-hDdSLF] [-c creds] [-t token] [-m jobs] [-s sla] [-n nas_host] [-f fileset] [-r minutes] [--page_size=n] [--poll_min=secs] [--poll_max=secs] [--restart_threads=n] [--pool_size=n] [--retries=n] [--retry_budget=n] [--launch_attempts=n] [--host_jobs=n[,host=n]] [--adaptive] [--min_jobs=n] [--queue_wait=secs] [--bulk_size=n] [--stream] [--window=n] [--cluster_map=file] [--cluster_jobs=n[,cluster=n]] [--pre=script] [--post=script] [--post_on_fail] [--hook_threads=n] [--hook_timeout=secs] [--metrics_json=file] [--metrics_prom=file] [--metrics_interval=secs] [--cache_ttl=minutes] [--refresh-cache] [--make_plan=file | --plan=file] [--validate] [--profile=prefix] file rubrik\n")
+    sys.stderr.write("       rbk_concurrent_nas_backup.py --serve=[host:]port|socket_path [--inventory_refresh=secs] [--script=name=script] [options] rubrik\n")
     sys.stderr.write("-h | --help : Prints this message\n")
     sys.stderr.write("-D | --DEBUG : Debug mode.  Verbose output for debugging\n")
     sys.stderr.write("-d | --nas_da : Set NAS DA when assigning a fileset to a share [default: False]\n")
     sys.stderr.write("-S | --sort_on_time : Sort jobs to be run by last backups time [default: False]\n")
+    sys.stderr.write("-L | --longest_first : Start the jobs that took longest in past runs first and predict the run time [default: False]\n")
     sys.stderr.write("-F | --flush : Don't try to restart clean (check for running and completed jobs)\n")
     sys.stderr.write("-c | --creds : Credentials for Rubrik [user:password]\n")
     sys.stderr.write("-t | --token : API Token for Rubrik\n")
-    sys.stderr.write("-m | --max_jobs : Maximum number of concurrent backup jobs [default: 2]\n")
+    sys.stderr.write("-m | --max_jobs : Maximum number of concurrent backup jobs (the ceiling with --adaptive) [default: 2]\n")
     sys.stderr.write("-s | --sla : Set a default SLA instead of specifying in the file\n")
     sys.stderr.write("-n | --nas_host : Set a default NAS host instead of specifying it in the file\n")
     sys.stderr.write("-f | --fileset : Set a default fileset instead of specifying it in the file\n")
     sys.stderr.write("-r | --report_time : Set a delay in reports to the screen in minutes [def: 0]\n")
+    sys.stderr.write("--page_size : Number of objects fetched per inventory API call [default: 1000]\n")
+    sys.stderr.write("--poll_min : Shortest time between status checks of a job in seconds [default: 10]\n")
+    sys.stderr.write("--poll_max : Longest time between status checks of a long running job in seconds [default: 300]\n")
+    sys.stderr.write("--restart_threads : Number of concurrent API calls used to check for running jobs on restart [default: 10]\n")
+    sys.stderr.write("--pool_size : Number of pooled HTTP connections to the cluster [default: larger of max_jobs and restart_threads]\n")
+    sys.stderr.write("--host_jobs : Limit concurrent jobs per NAS host and spread jobs across hosts [n[,host=n,...]]\n")
+    sys.stderr.write("--adaptive : Raise and lower the number of concurrent jobs between --min_jobs and --max_jobs based on cluster load\n")
+    sys.stderr.write("--min_jobs : Lowest number of concurrent jobs in adaptive mode [default: 1]\n")
+    sys.stderr.write("--queue_wait : In adaptive mode, back off when jobs wait longer than this many seconds to start running [default: 300]\n")
+    sys.stderr.write("--retries : Number of retries of an API call that timed out or was throttled [default: 4]\n")
+    sys.stderr.write("--retry_budget : Most API retries allowed per cluster per hour.  Spent retries come back gradually over the hour [default: 500]\n")
+    sys.stderr.write("--launch_attempts : Number of times to try to start a backup before failing it [default: 3]\n")
+    sys.stderr.write("--stream : Start backups while the rest of the input file is still being resolved\n")
+    sys.stderr.write("--window : Number of input lines resolved, checked and sorted together in stream mode [default: 100]\n")
+    sys.stderr.write("--bulk_size : Number of filesets created per bulk API call [default: 100]\n")
+    sys.stderr.write("--cluster_map : File of nas_host,cluster lines to send each host's jobs to its own Rubrik cluster\n")
+    sys.stderr.write("--cluster_jobs : Per cluster overrides of --max_jobs, for every cluster or named ones [n[,cluster=n,...]]\n")
+    sys.stderr.write("--pre : Script to run before each backup.  A pre=script column in the input file overrides it for that share\n")
+    sys.stderr.write("--post : Script to run after each successful backup.  A post=script column in the input file overrides it for that share\n")
+    sys.stderr.write("--post_on_fail : Run post scripts after failed backups too\n")
+    sys.stderr.write("--hook_threads : Number of pre/post scripts run at once.  Pre scripts of the next jobs in line run while the backup slots are busy [default: 4]\n")
+    sys.stderr.write("--hook_timeout : Kill a pre/post script that runs longer than this many seconds [default: 0 (no limit)]\n")
+    sys.stderr.write("--metrics_json : Append job, script, slot and API events to this file as JSON lines\n")
+    sys.stderr.write("--metrics_prom : Write run totals to this file in Prometheus textfile format\n")
+    sys.stderr.write("--metrics_interval : Seconds between slot samples and Prometheus file updates during the run [default: 60]\n")
+    sys.stderr.write("--serve : Run as a service taking backup requests over HTTP on a local port or Unix socket instead of reading a file\n")
+    sys.stderr.write("--script : In service mode, a script requests can name as pre or post, e.g. --script=quiesce=/usr/local/bin/quiesce.sh.  Repeat for more.  Requests can't run any other commands\n")
+    sys.stderr.write("--inventory_refresh : In service mode, reload a cluster's inventory when a request names an unknown share, at most this often in seconds [default: 300]\n")
+    sys.stderr.write("--cache_ttl : Cache share, SLA and fileset inventory on disk for this many minutes [default: 0 (off)]\n")
+    sys.stderr.write("--refresh-cache : Ignore any cached inventory and fetch it from the cluster\n")
+    sys.stderr.write("--make_plan : Resolve the input file against the inventory, creating any missing filesets, write the result to this plan file and exit\n")
+    sys.stderr.write("--validate | --dry-run : Check the options and input file without connecting to the cluster and exit\n")
+    sys.stderr.write("--profile : Write cProfile and tracemalloc output for the inventory load, job queue generation and main loop to prefix.<phase>.prof and prefix.<phase>.mem.txt\n")
+    sys.stderr.write("--plan : Run from a plan file made by --make_plan without loading the inventory.  Jobs whose IDs the cluster rejects are re-resolved\n")
     sys.stderr.write("file : Input file for jobs\n")
-    sys.stderr.write("rubrik : Hostname or IP of the Rubrik cluster\n")
+    sys.stderr.write("rubrik : Hostname or IP of the Rubrik cluster.  Use a comma separated list for more than one\n")
     exit(0)
 
 def dprint(message):
     if DEBUG:
+        say(message)
+
+def say(message, error=False):
+    feed = getattr(output, 'feed', None)
+    if feed is not None:
+        feed.put(('say', (message, error)))
+    elif error:
+        sys.stderr.write(message + "\n")
+    else:
         print(message)
+    return
 
 def python_input(message):
     if int(sys.version[0]) > 2:
@@ -43,76 +109,164 @@ def python_input(message):
         val = raw_input(message)
     return(val)
 
-def get_hs_id(hs_data, host, share):
-    for h in hs_data['data']:
-        if h['hostname'] == host and h['exportPoint'] == share:
-            return(h['id'])
-    return("")
+def get_inventory(rubrik, api, endpoint, fields):
+    offset = 0
+    if '?' in endpoint:
+        sep = '&'
+    else:
+        sep = '?'
+    while True:
+        page_url = endpoint + sep + "limit=" + str(page_size) + "&offset=" + str(offset)
+        dprint("PAGE: /" + api + page_url)
+        page = rubrik.get(api, page_url, timeout=timeout)
+        for item in page['data']:
+            yield dict((k, item[k]) for k in fields if k in item)
+        offset += len(page['data'])
+        if not page['data'] or not page.get('hasMore', False):
+            break
 
-def get_sla_id(sla_data, name):
-    for s in sla_data['data']:
-        if s['name'] == name:
-            return(s['id'])
-    return("")
+def load_inventory(cluster, api, endpoint, fields):
+    key = api + ":" + endpoint
+    data = rbk_cache.cache_get(cluster['cache'], key)
+    if data is not None:
+        dprint("CACHE HIT: " + cluster['name'] + " " + key)
+        return(data)
+    if not cluster['cache']['enabled']:
+        return(get_inventory(cluster['rubrik'], api, endpoint, fields))
+    data = list(get_inventory(cluster['rubrik'], api, endpoint, fields))
+    rbk_cache.cache_put(cluster['cache'], key, data)
+    return(data)
 
-def get_fs_id(hs_id, fs_data, def_fst_id):
-    fs_id_list = []
-    dprint("HS_ID: " + hs_id)
-    dprint("DEF_FST: " + def_fst_id)
-    for f in fs_data['data']:
-        if not def_fst_id:
-            try:
-                if f['shareId'] == hs_id:
-                    fs_id_list.append(f['id'])
-            except:
-                continue
-        else:
-            try:
-                if f['shareId'] == hs_id and f['templateId'] == def_fst_id:
-                    fs_id_list.append(f['id'])
-            except:
+def read_cluster_map(map_file):
+    host_map = {}
+    with open(map_file) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
                 continue
-    return(fs_id_list)
+            (host, cluster) = line.split(',')
+            host_map[host.strip()] = cluster.strip()
+    return(host_map)
 
-def rewrite_log_file(log_file, done_jobs):
-    lc = open(log_file, "w")
-    for dj in done_jobs:
-        lc.write(dj['host'] + "," + dj['share'] + ",SUCCEEDED," + dj['date'] + "\n")
-    lc.close()
-    return
+def cluster_for_host(host):
+    return(clusters[cluster_map.get(host, rubrik_hosts[0])])
 
-def compare_job_queues(done, new):
-    for n in new:
-        found = False
-        for dj in done:
-            if dj['host'] == n['host'] and dj['share'] == n['share']:
-                found = True
-                break
-        if not found:
-            return(False)
-    return(True)
+def job_clusters(hosts):
+    names = set()
+    for host in set(hosts):
+        if cluster_map and host not in cluster_map:
+            sys.stderr.write("WARNING: " + host + " is not in " + cluster_map_file + " so its shares are looked up on " + rubrik_hosts[0] + "\n")
+        names.add(cluster_map.get(host, rubrik_hosts[0]))
+    return([name for name in rubrik_hosts if name in names] or rubrik_hosts[:1])
 
-def check_job_status_log(log_file, new_job_queue):
-    done_jobs = []
-    to_do = False
-    if not path.isfile(log_file):
-        return([])
-    with open(log_file) as fp:
-        for line in fp:
-            line = line.rstrip()
-            if not line:
-                continue
-            (host, share, status, date)  = line.split(',')
-            if status == "SUCCEEDED":
-                done_jobs.append({'host': host, 'share': share, 'date': date})
-            else:
-                to_do = True
-    fp.close()
-    if compare_job_queues(done_jobs, new_job_queue):
-        return([])
-    if to_do:
-        rewrite_log_file(log_file, done_jobs)
-    return(done_jobs)
+def cluster_label(cluster):
+    if len(rubrik_hosts) > 1:
+        return("[" + cluster['name'] + "] ")
+    return("")
+
+def total_jobs():
+    return(sum(c['max_jobs'] for c in clusters.values()))
+
+def connect_cluster(name):
+    cluster = {'name': name, 'max_jobs': cluster_limits.get(name, cluster_jobs or max_jobs), 'fst_id': ""}
+    c_pool_size = max(pool_size, cluster['max_jobs'])
+    if token:
+        cluster['rubrik'] = rbk_api.Connect(name, api_token=token, pool_size=c_pool_size, retries=retries, retry_budget=retry_budget)
+    else:
+        cluster['rubrik'] = rbk_api.Connect(name, user, password, pool_size=c_pool_size, retries=retries, retry_budget=retry_budget)
+    cluster['cache'] = rbk_cache.load_cache(name, cache_ttl, refresh_cache)
+    if plan:
+        return(check_plan_cluster(cluster))
+    if default_fileset:
+        cluster['fst_id'] = get_fst_id(cluster['rubrik'], default_fileset)
+        if not cluster['fst_id']:
+            sys.stderr.write(cluster_label(cluster) + "Can't find default fileset template: " + default_fileset + "\n")
+            exit(2)
+    start = time.time()
+    inventory = load_cluster_inventory(cluster)
+    load_time = time.time() - start
+    rbk_metrics.set_value(metrics, 'inventory_load_seconds', round(load_time, 3), cluster=name)
+    rbk_metrics.event(metrics, 'inventory', cluster=name, seconds=round(load_time, 3), shares=len(inventory['hs']),
+                      slas=len(inventory['sla']), filesets=inventory['fs_total'])
+    if DEBUG:
+        print("HOST=" + default_host)
+        for (h, e) in inventory['hs']:
+            if h == default_host:
+               print("FOUND " + h + ":" + e)
+    if not inventory['hs']:
+        sys.stderr.write(cluster_label(cluster) + "No NAS Shares found.\n")
+        exit(1)
+    if not inventory['sla']:
+        sys.stderr.write(cluster_label(cluster) + "No SLAs found?!\n")
+        exit(2)
+    if inventory['fs_total'] == 0 and not cluster['fst_id'] and not SERVE:
+        sys.stderr.write(cluster_label(cluster) + "No Filesets found\n")
+        exit(3)
+    cluster['inventory'] = inventory
+    cluster['loaded'] = time.time()
+    return(cluster)
+
+def inventory_endpoints(cluster):
+    (hs_scope, sla_scope, fs_scope) = (default_host, default_sla, cluster['fst_id'])
+    if SERVE:
+        (hs_scope, sla_scope, fs_scope) = ("", "", "")
+    return([('shares', 'internal', scoped_endpoint('/host/share', 'hostname', hs_scope)),
+            ('slas', 'v2', scoped_endpoint('/sla_domain', 'name', sla_scope)),
+            ('filesets', 'v1', scoped_endpoint('/fileset', 'template_id', fs_scope))])
+
+def load_cluster_inventory(cluster):
+    (hs, sla, fs) = inventory_endpoints(cluster)
+    return(index_inventory(load_inventory(cluster, hs[1], hs[2], ('id', 'hostname', 'exportPoint')),
+                           load_inventory(cluster, sla[1], sla[2], ('id', 'name')),
+                           load_inventory(cluster, fs[1], fs[2], ('id', 'shareId', 'templateId'))))
+
+def scoped_endpoint(endpoint, param, value):
+    if not value:
+        return(endpoint)
+    return(endpoint + "?" + param + "=" + quote(value, safe=''))
+
+def index_inventory(hs_list, sla_list, fs_list):
+    inventory = {'hs': {}, 'sla': {}, 'fs': {}, 'fs_share': {}, 'fs_total': 0}
+    start = time.time()
+    for h in hs_list:
+        inventory['hs'].setdefault((h['hostname'], h['exportPoint']), h['id'])
+    for s in sla_list:
+        inventory['sla'].setdefault(s['name'], s['id'])
+    for f in fs_list:
+        inventory['fs_total'] += 1
+        try:
+            add_fs_to_inventory(inventory, f['shareId'], f['templateId'], f['id'])
+        except KeyError:
+            continue
+    dprint("INDEX: " + str(len(inventory['hs'])) + " shares, " + str(len(inventory['sla'])) + " SLAs, " +
+           str(len(inventory['fs_share'])) + " shares with filesets in " + str(round(time.time() - start, 3)) + "s")
+    return(inventory)
+
+def add_fs_to_inventory(inventory, hs_id, fst_id, fs_id):
+    inventory['fs_share'].setdefault(hs_id, []).append(fs_id)
+    inventory['fs'].setdefault((hs_id, fst_id), []).append(fs_id)
+
+def get_hs_id(inventory, host, share):
+    return(inventory['hs'].get((host, share), ""))
+
+def get_sla_id(inventory, name):
+    return(inventory['sla'].get(name, ""))
+
+def get_fs_id(hs_id, inventory, def_fst_id):
+    dprint("HS_ID: " + hs_id)
+    dprint("DEF_FST: " + def_fst_id)
+    if not def_fst_id:
+        return(list(inventory['fs_share'].get(hs_id, [])))
+    return(list(inventory['fs'].get((hs_id, def_fst_id), [])))
+
+def check_job_status_log(journal, new_job_queue):
+    done = rbk_journal.done_jobs(journal)
+    if not done:
+        return({})
+    for n in new_job_queue:
+        if (n['host'], n['share']) not in done:
+            return(done)
+    return({})
 
 def get_fst_id(rubrik, def_fst):
     fst_data = rubrik.get('v1', '/fileset_template?name=' + def_fst, timeout=timeout)
@@ -124,111 +278,1076 @@ def get_fst_id(rubrik, def_fst):
     except:
         return("")
 
-def add_template_to_share(hs_id, fst_id):
-    payload = [{'shareId': hs_id, 'templateId': fst_id, 'isPassthrough': NAS_DA, 'enableSymlinkResolution': False, 'enableHardlinkSupport': False}]
+def add_template_to_shares(cluster, hs_ids, fst_id):
+    payload = [{'shareId': hs_id, 'templateId': fst_id, 'isPassthrough': NAS_DA, 'enableSymlinkResolution': False, 'enableHardlinkSupport': False}
+               for hs_id in hs_ids]
     dprint("PAYLOAD " + str(payload))
-    new_fs = rubrik.post('internal', '/fileset/bulk', payload, timeout=timeout)
-    return(new_fs['data'][0]['id'])
+    new_fs = cluster['rubrik'].post('internal', '/fileset/bulk', payload, timeout=timeout)
+    rbk_cache.cache_invalidate(cluster['cache'], 'v1:/fileset')
+    created = {}
+    for f in new_fs['data']:
+        created[f['shareId']] = f['id']
+    return(created)
 
-def get_job_queue(hs_data, sla_data, fs_data, infile, default_host, def_sla, def_fst_id):
-    new_job_queue = []
-    completed_job_queue = []
-    print("Generating Job Queue")
+def existing_filesets(cluster, hs_ids, fst_id):
+    found = {}
+    for hs_id in hs_ids:
+        endpoint = "/fileset?share_id=" + quote(hs_id, safe='') + "&template_id=" + quote(fst_id, safe='')
+        for f in get_inventory(cluster['rubrik'], 'v1', endpoint, ('id', 'shareId', 'templateId')):
+            if f.get('shareId') == hs_id and f.get('templateId') == fst_id:
+                found[hs_id] = f['id']
+    return(found)
+
+def unclear_create(cluster, hs_ids, fst_id, e, created, failed):
+    if not rbk_api.outcome_unknown(e):
+        return(hs_ids)
+    dprint("FILESET CREATE UNCLEAR: " + str(hs_ids) + " " + str(e))
+    rbk_cache.cache_invalidate(cluster['cache'], 'v1:/fileset')
+    try:
+        found = existing_filesets(cluster, hs_ids, fst_id)
+    except Exception as e2:
+        for hs_id in hs_ids:
+            failed[hs_id] = str(e) + ", and can't tell whether the fileset was created: " + str(e2)
+        return([])
+    created.update(found)
+    return([hs_id for hs_id in hs_ids if hs_id not in found])
+
+def create_filesets(cluster, hs_ids, fst_id, failed):
+    created = {}
+    for i in range(0, len(hs_ids), bulk_size):
+        chunk = hs_ids[i:i + bulk_size]
+        try:
+            created.update(add_template_to_shares(cluster, chunk, fst_id))
+        except Exception as e:
+            retry = unclear_create(cluster, chunk, fst_id, e, created, failed)
+            if len(chunk) == 1:
+                for hs_id in retry:
+                    failed[hs_id] = str(e)
+                continue
+            if retry:
+                say("Bulk fileset create failed (" + str(e) + "). Trying shares one at a time", True)
+            for hs_id in retry:
+                try:
+                    created.update(add_template_to_shares(cluster, [hs_id], fst_id))
+                except Exception as e:
+                    if unclear_create(cluster, [hs_id], fst_id, e, created, failed):
+                        failed[hs_id] = str(e)
+    for hs_id in created:
+        add_fs_to_inventory(cluster['inventory'], hs_id, fst_id, created[hs_id])
+    return(created)
+
+def check_running_job(j):
+    rubrik = clusters[j['cluster']]['rubrik']
+    j_run = rubrik.get('v1', '/event/latest?event_status=Running&event_type=Backup&object_ids=' + str(j['hs_id']) + ',' + str(j['fs_id']))
+    try:
+        rj_id = j_run['data'][0]['latestEvent']['jobInstanceId']
+        url = "/fileset/request/" + str(rj_id)
+        return({'host': j['host'], 'share': j['share'], 'cluster': j['cluster'], 'status': url, 'pre': "", 'post': j['post']})
+    except:
+        if SORT_ON_TIME:
+            j_inst = rubrik.get('v1', '/event/latest?event_status=Success&event_type=Backup&object_ids=' + str(j['hs_id']) + ',' + str(j['fs_id']))
+            try:
+                event_time = j_inst['data'][0]['latestEvent']['time']
+                time_dt = datetime.strptime(event_time[:-5], "%Y-%m-%dT%H:%M:%S")
+                j['time'] = int((time_dt - EPOCH).total_seconds())
+            except:
+                j['time'] = 0
+    return(None)
+
+def predict_makespan(durations, slots):
+    finish = [0] * max(slots, 1)
+    for d in durations:
+        heapq.heappush(finish, heapq.heappop(finish) + d)
+    return(max(finish))
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return(str(seconds // 3600) + "h" + str((seconds % 3600) // 60).zfill(2) + "m")
+
+def report_makespan(expected, known):
+    say("PREDICTED MAKESPAN: " + format_duration(predict_makespan(expected, total_jobs())) +
+        " (" + str(known) + " of " + str(len(expected)) + " jobs with history)")
+    return
+
+def sort_longest_first(new_job_queue, job_times=None):
+    report = job_times is None
+    if report:
+        job_times = rbk_journal.job_durations(journal)
+    known = sorted(job_times[(j['host'], j['share'])] for j in new_job_queue if (j['host'], j['share']) in job_times)
+    if known:
+        default = known[len(known) // 2]
+    else:
+        default = 0
+    for j in new_job_queue:
+        j['expected'] = job_times.get((j['host'], j['share']), default)
+    new_job_queue.sort(key=operator.itemgetter('expected'), reverse=True)
+    if report:
+        report_makespan([j['expected'] for j in new_job_queue], len(known))
+    return(len(known))
+
+def split_line(line, default_host):
+    lf = line.split(',')
+    if default_host:
+        first = 1
+    else:
+        first = 2
+    hooks = {'pre': default_pre, 'post': default_post}
+    fields = lf[:first]
+    for field in lf[first:]:
+        for kind in ('pre', 'post'):
+            if field.startswith(kind + '='):
+                hooks[kind] = field[len(kind) + 1:]
+                break
+        else:
+            fields.append(field)
+    return(fields, hooks)
+
+def read_input(infile, default_host):
+    global PRE_HOOKS
     with open(infile) as fp:
         for line in fp:
             line = line.rstrip()
             if not line or line.startswith('#'):
                 continue
-            lf = line.split(',')
+            (lf, hooks) = split_line(line, default_host)
+            if hooks['pre']:
+                PRE_HOOKS = True
             if default_host:
-                host = default_host
-                share = lf[0]
+                yield(default_host, lf[0], lf, hooks)
             else:
-                host = lf[0]
-                share = lf[1]
-            hs_id = get_hs_id(hs_data, host, share)
-            if hs_id == "":
-                sys.stderr.write("Can't find " + host + ":" + share + ". Skipping\n")
+                yield(lf[0], lf[1], lf, hooks)
+
+def check_input(infile):
+    jobs = []
+    problems = []
+    try:
+        fp = open(infile)
+    except (IOError, OSError) as e:
+        return(jobs, [str(e)])
+    with fp:
+        line_no = 0
+        for line in fp:
+            line_no += 1
+            line = line.rstrip()
+            if not line or line.startswith('#'):
                 continue
-            if def_sla:
-                sla_id = get_sla_id(sla_data, def_sla)
-                sla = def_sla
-            else:
-                sla_id = get_sla_id(sla_data, lf[-1])
-                sla = lf[-1]
-                if sla_id == "":
-                    sys.stderr.write("Can't find SLA: " + sla + ". Skipping\n")
+            lf = split_line(line, default_host)[0]
+            if default_host:
+                lf.insert(0, default_host)
+            if len(lf) < 2 or not lf[0] or not lf[1] or lf[1].startswith(('pre=', 'post=')):
+                problems.append("line " + str(line_no) + ": expected " + ("share" if default_host else "host,share") +
+                                ("" if default_sla else ",sla") + ": " + line)
+                continue
+            sla = default_sla
+            if not sla:
+                if len(lf) < 3 or not lf[-1]:
+                    problems.append("line " + str(line_no) + ": no SLA column and no -s: " + line)
                     continue
-            fs_id_list = get_fs_id(hs_id, fs_data, def_fst_id)
-            dprint("FS_ID_LIST: " + str(fs_id_list))
-            if len(fs_id_list) == 0:
-                print("Creating fileset on " + host + ":" + share)
-                fs_id = add_template_to_share(hs_id, def_fst_id)
-            elif len(fs_id_list) > 1:
-                sys.stderr.write("Found multiple filsets for " + host + ":" + share + ". Skipping\n")
+                sla = lf[-1]
+            jobs.append((line_no, lf[0], lf[1], sla))
+    return(jobs, problems)
+
+def check_cached_inventory(jobs):
+    warnings = []
+    for name in rubrik_hosts:
+        entries = rbk_cache.cached_entries(name)
+        endpoints = dict((e[0], e[1] + ":" + e[2]) for e in inventory_endpoints({'fst_id': ""}))
+        if endpoints['shares'] not in entries or endpoints['slas'] not in entries:
+            continue
+        shares = set((h['hostname'], h['exportPoint']) for h in entries[endpoints['shares']]['data'])
+        slas = set(s['name'] for s in entries[endpoints['slas']]['data'])
+        age = format_duration(time.time() - min(entries[endpoints['shares']]['time'], entries[endpoints['slas']]['time']))
+        for (line_no, host, share, sla) in jobs:
+            if cluster_map.get(host, rubrik_hosts[0]) != name:
                 continue
+            if (host, share) not in shares:
+                warnings.append("line " + str(line_no) + ": " + host + ":" + share + " is not in the cached inventory of " + name + " (" + age + " old)")
+            if sla not in slas:
+                warnings.append("line " + str(line_no) + ": SLA " + sla + " is not in the cached inventory of " + name + " (" + age + " old)")
+    return(warnings)
+
+def validate_run(infile):
+    problems = []
+    warnings = []
+    if max_jobs < 1 or min_jobs < 1 or min_jobs > max_jobs:
+        problems.append("need 1 <= --min_jobs <= --max_jobs")
+    if poll_min < 1 or poll_max < poll_min:
+        problems.append("need 1 <= --poll_min <= --poll_max")
+    for (opt, value) in (('page_size', page_size), ('bulk_size', bulk_size), ('window', stream_window), ('hook_threads', hook_threads),
+                         ('restart_threads', restart_threads), ('launch_attempts', launch_attempts)):
+        if value < 1:
+            problems.append("--" + opt + " must be at least 1")
+    if not token and not (user and password):
+        warnings.append("no -c or -t given so the run will prompt for credentials")
+    if SERVE:
+        jobs = []
+    else:
+        (jobs, input_problems) = check_input(infile)
+        problems += input_problems
+        if plan_file:
+            try:
+                problems += ["plan: " + p for p in rbk_plan.plan_problems(rbk_plan.read_plan(plan_file), infile, plan_options(),
+                                                                          job_clusters(j[1] for j in jobs))]
+            except (IOError, OSError, ValueError) as e:
+                problems.append("can't read plan " + plan_file + ": " + str(e))
+        seen = {}
+        for (line_no, host, share, sla) in jobs:
+            if (host, share) in seen:
+                warnings.append("line " + str(line_no) + ": " + host + ":" + share + " is already on line " + str(seen[(host, share)]))
             else:
-                fs_id = fs_id_list[0]
-            new_job_queue.append({'host': host, 'share': share, 'hs_id': hs_id, 'sla_id': sla_id, 'fs_id': fs_id})
-    fp.close()
+                seen[(host, share)] = line_no
+        warnings += check_cached_inventory(jobs)
+        print(infile + ": " + str(len(jobs)) + " jobs on " + str(len(set(j[1] for j in jobs))) + " hosts using SLAs " +
+              ", ".join(sorted(set(j[3] for j in jobs))))
+    for (label, messages) in (("WARNING: ", warnings), ("ERROR: ", problems)):
+        for m in messages[:VALIDATE_LINES]:
+            sys.stderr.write(label + m + "\n")
+        if len(messages) > VALIDATE_LINES:
+            sys.stderr.write(label + "... and " + str(len(messages) - VALIDATE_LINES) + " more\n")
+    if problems:
+        return(2)
+    print("OK")
+    return(0)
+
+def resolve_job(host, share, lf, def_sla, fst_id=None):
+    cluster = cluster_for_host(host)
+    if fst_id is None:
+        fst_id = cluster['fst_id']
+    inventory = cluster['inventory']
+    hs_id = get_hs_id(inventory, host, share)
+    if hs_id == "":
+        say("Can't find " + host + ":" + share + ". Skipping", True)
+        return(None)
+    if def_sla:
+        sla_id = get_sla_id(inventory, def_sla)
+        sla = def_sla
+    else:
+        sla_id = get_sla_id(inventory, lf[-1])
+        sla = lf[-1]
+        if sla_id == "":
+            say("Can't find SLA: " + sla + ". Skipping", True)
+            return(None)
+    fs_id_list = get_fs_id(hs_id, inventory, fst_id)
+    dprint("FS_ID_LIST: " + str(fs_id_list))
+    if len(fs_id_list) == 0:
+        fs_id = ""
+    elif len(fs_id_list) > 1:
+        say("Found multiple filsets for " + host + ":" + share + ". Skipping", True)
+        return(None)
+    else:
+        fs_id = fs_id_list[0]
+    return({'host': host, 'share': share, 'cluster': cluster['name'], 'hs_id': hs_id, 'sla_id': sla_id, 'fs_id': fs_id, 'fst_id': fst_id,
+            'sla': sla})
+
+def fill_new_filesets(jobs):
+    new_filesets = {}
+    seen = set()
+    for j in jobs:
+        if not j['fs_id'] and (j['cluster'], j['fst_id'], j['hs_id']) not in seen:
+            say("Creating fileset on " + j['host'] + ":" + j['share'])
+            new_filesets.setdefault((j['cluster'], j['fst_id']), []).append(j['hs_id'])
+            seen.add((j['cluster'], j['fst_id'], j['hs_id']))
+    if not new_filesets:
+        return(jobs)
+    created = {}
+    failed = {}
+    for (name, fst_id) in new_filesets:
+        failed[(name, fst_id)] = {}
+        for (hs_id, fs_id) in create_filesets(clusters[name], new_filesets[(name, fst_id)], fst_id, failed[(name, fst_id)]).items():
+            created[(name, fst_id, hs_id)] = fs_id
+    for j in jobs:
+        if not j['fs_id']:
+            j['fs_id'] = created.get((j['cluster'], j['fst_id'], j['hs_id']), "")
+            if not j['fs_id']:
+                error = failed.get((j['cluster'], j['fst_id']), {}).get(j['hs_id'])
+                if error:
+                    say("Can't create fileset on " + j['host'] + ":" + j['share'] + " (" + error + "). Skipping", True)
+                else:
+                    say("Can't create fileset on " + j['host'] + ":" + j['share'] + ". Skipping", True)
+    return([j for j in jobs if j['fs_id']])
+
+def check_running_jobs(pool, jobs):
+    running_list = pool.map(check_running_job, jobs)
+    return([j for (j, rj) in zip(jobs, running_list) if not rj], [rj for rj in running_list if rj])
+
+def resolve_input(infile, default_host, def_sla):
+    new_job_queue = []
+    for (host, share, lf, hooks) in read_input(infile, default_host):
+        j = resolve_job(host, share, lf, def_sla)
+        if j:
+            j.update(hooks)
+            new_job_queue.append(j)
+    return(fill_new_filesets(new_job_queue))
+
+def get_job_queue(infile, default_host, def_sla):
+    global PRE_HOOKS
+    completed_job_queue = []
+    print("Generating Job Queue")
+    start = time.time()
+    if plan:
+        new_job_queue = list(rbk_plan.plan_jobs(plan))
+        PRE_HOOKS = any(j['pre'] for j in new_job_queue)
+    else:
+        new_job_queue = resolve_input(infile, default_host, def_sla)
+    dprint("Resolved " + str(len(new_job_queue)) + " jobs in " + str(round(time.time() - start, 3)) + "s")
     if RESTART:
-        epoch = datetime.strptime("1970-01-01T00:00:00", "%Y-%m-%dT%H:%M:%S")
-        job_delete_queue = []
-        running_jobs = []
-        for j in new_job_queue:
-            j_run = rubrik.get('v1', '/event/latest?event_status=Running&event_type=Backup&object_ids=' + str(j['hs_id']) + ',' + str(j['fs_id']))
-            try:
-                rj_id = j_run['data'][0]['latestEvent']['jobInstanceId']
-                url = "/fileset/request/" + str(rj_id)
-                running_jobs.append({'host': j['host'], 'share': j['share'], 'status': url})
-                job_delete_queue.append(j)
-            except:
-                if SORT_ON_TIME:
-                    j_inst = rubrik.get('v1', '/event/latest?event_status=Success&event_type=Backup&object_ids=' + str(j['hs_id']) + ',' + str(j['fs_id']))
-                    try:
-                        time = j_inst['data'][0]['latestEvent']['time']
-                        time_dt = datetime.strptime(time[:-5], "%Y-%m-%dT%H:%M:%S")
-                        j['time'] = int((time_dt - epoch).total_seconds())
-                    except:
-                        j['time'] = 0
-        for dj in job_delete_queue:
-            new_job_queue.remove(dj)
-        completed_job_queue = check_job_status_log(log_file, new_job_queue)
+        start = time.time()
+        checked = len(new_job_queue)
+        pool = ThreadPool(restart_threads)
+        (new_job_queue, running_jobs) = check_running_jobs(pool, new_job_queue)
+        pool.close()
+        pool.join()
+        dprint("Restart check of " + str(checked) + " jobs in " + str(round(time.time() - start, 3)) + "s")
+        completed = check_job_status_log(journal, new_job_queue)
+        completed_job_queue = [{'host': host, 'share': share, 'date': completed[(host, share)]} for (host, share) in completed]
         dprint("NEW JOBS: " + str(new_job_queue))
         dprint("COMPLETED: " + str(completed_job_queue))
-        if completed_job_queue:
+        if completed:
             print("Purging Completed Jobs")
-            for cj in completed_job_queue:
-                for j in new_job_queue:
-                    if j['host'] == cj['host'] and j['share'] == cj['share']:
-                        new_job_queue.remove(j)
-                        break
+            new_job_queue = [j for j in new_job_queue if (j['host'], j['share']) not in completed]
         else:
-            fp = open(log_file, "w")
-            fp.close()
+            rbk_journal.start_run(journal)
         if SORT_ON_TIME:
             new_job_queue.sort(key=operator.itemgetter('time'))
+        if LONGEST_FIRST:
+            sort_longest_first(new_job_queue)
         dprint("\nJOB_QUEUE: " + str(new_job_queue))
         print("QUEUE LENGTH:" + str(len(new_job_queue)))
         print("ALREADY RUNNING JOBS: " + str(len(running_jobs)))
         return(new_job_queue, running_jobs, completed_job_queue)
     else:
-        fp = open(log_file, "w")
-        fp.close()
+        rbk_journal.start_run(journal)
+    if LONGEST_FIRST:
+        sort_longest_first(new_job_queue)
     return(new_job_queue, [], [])
 
-def log_job(lfile, job, job_status):
-    date_s = datetime.now().strftime("%Y-%m-%dT%H:%M")
-    fp = open(lfile, "a")
-    fp.write(job['host'] + "," + job['share'] + "," + job_status + "," + date_s + "\n")
-    fp.close()
+def feed_jobs(pool, batch, job_times, prediction, feed):
+    batch = fill_new_filesets(batch)
+    running_jobs = []
+    if RESTART:
+        (batch, running_jobs) = check_running_jobs(pool, batch)
+        if SORT_ON_TIME:
+            batch.sort(key=operator.itemgetter('time'))
+    if LONGEST_FIRST:
+        prediction['known'] += sort_longest_first(batch, job_times)
+        prediction['expected'] += [j['expected'] for j in batch]
+    for rj in running_jobs:
+        feed.put(('running', rj))
+    for j in batch:
+        feed.put(('queue', j))
+    return(len(batch) + len(running_jobs))
+
+def count_input_lines(infile):
+    count = 0
+    with open(infile) as fp:
+        for line in fp:
+            line = line.rstrip()
+            if line and not line.startswith('#'):
+                count += 1
+    return(count)
+
+def stream_job_queue(infile, default_host, def_sla, feed):
+    output.feed = feed
+    lines = 0
+    fed_lines = 0
+    try:
+        say("Streaming Job Queue")
+        start = time.time()
+        completed = {}
+        if RESTART:
+            completed = check_job_status_log(journal, [{'host': h, 'share': s} for (h, s, lf, hooks) in read_input(infile, default_host)])
+        if completed:
+            say("Purging Completed Jobs")
+            feed.put(('completed', [{'host': host, 'share': share, 'date': completed[(host, share)]} for (host, share) in completed]))
+        else:
+            rbk_journal.start_run(journal)
+        job_times = {}
+        prediction = {'expected': [], 'known': 0}
+        if LONGEST_FIRST:
+            job_times = rbk_journal.job_durations(journal)
+        pool = ThreadPool(restart_threads)
+        batch = []
+        count = 0
+        for (host, share, lf, hooks) in read_input(infile, default_host):
+            lines += 1
+            if (host, share) in completed:
+                continue
+            j = resolve_job(host, share, lf, def_sla)
+            if j:
+                j.update(hooks)
+                batch.append(j)
+            if len(batch) >= stream_window:
+                count += feed_jobs(pool, batch, job_times, prediction, feed)
+                fed_lines = lines
+                batch = []
+        if batch:
+            count += feed_jobs(pool, batch, job_times, prediction, feed)
+        fed_lines = lines
+        pool.close()
+        pool.join()
+        say("Job Queue Complete: " + str(count) + " jobs in " + str(round(time.time() - start, 1)) + "s")
+        if LONGEST_FIRST:
+            report_makespan(prediction['expected'], prediction['known'])
+    except Exception as e:
+        try:
+            unqueued = " (" + str(count_input_lines(infile) - fed_lines) + " input lines not queued)"
+        except (IOError, OSError):
+            unqueued = ""
+        stream_errors.append("Job queue generation stopped at entry " + str(lines + 1) + " of " + infile + unqueued + ": " +
+                             repr(e))
+        say(stream_errors[-1], True)
+    finally:
+        feed.put(None)
+    return
+
+def get_job_id(job):
+    if job['status'].startswith('/'):
+        return(job['status'].split('/')[-1])
+    return("")
+
+def log_job(journal, job, job_status, duration=None):
+    rbk_journal.log_job(journal, job['host'], job['share'], job_status, get_job_id(job), duration)
+    return
+
+def record_job(job):
+    rbk_metrics.count(metrics, 'jobs_total', status=job['status'], cluster=job['cluster'])
+    for field in ('queue_wait', 'launch_latency', 'start_wait', 'duration'):
+        if job.get(field) is not None:
+            job[field] = round(job[field], 3)
+    rbk_metrics.observe(metrics, 'job_start_wait_seconds', job.get('start_wait'), cluster=job['cluster'])
+    rbk_metrics.observe(metrics, 'job_run_seconds', job.get('duration'), cluster=job['cluster'], status=job['status'])
+    rbk_metrics.event(metrics, 'job_done', host=job['host'], share=job['share'], cluster=job['cluster'], status=job['status'],
+                      job_id=job.get('job_id', ""), queue_wait=job.get('queue_wait'), launch_latency=job.get('launch_latency'),
+                      start_wait=job.get('start_wait'), duration=job.get('duration'))
     return
 
 def print_job_report(job, status, j_cnt):
     date_s = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
     if j_cnt == 1:
         print(date_s)
-    print ("\tJOB STATUS: " + job['host'] + ":" + job['share'] + " : " + status)
+    if len(clusters) > 1:
+        print ("\tJOB STATUS: [" + job['cluster'] + "] " + job['host'] + ":" + job['share'] + " : " + status)
+    else:
+        print ("\tJOB STATUS: " + job['host'] + ":" + job['share'] + " : " + status)
+    return
+
+def adopt_running_job(new_job):
+    try:
+        rj = check_running_job(new_job)
+    except Exception as e:
+        sys.stderr.write("Can't check for a running backup of " + new_job['host'] + ":" + new_job['share'] + ": " + str(e) + "\n")
+        return(None, False)
+    new_job['unclear'] = False
+    if not rj:
+        return(None, True)
+    print("Found a running backup of " + new_job['host'] + ":" + new_job['share'] + " from an earlier attempt")
+    rj['pre'] = new_job['pre']
+    if 'handle' in new_job:
+        rj['handle'] = new_job['handle']
+    rj['job_id'] = get_job_id(rj)
+    rbk_metrics.event(metrics, 'job_adopted', host=rj['host'], share=rj['share'], cluster=rj['cluster'], job_id=rj['job_id'])
+    return(rj, True)
+
+def launch_job(new_job):
+    rubrik = clusters[new_job['cluster']]['rubrik']
+    if new_job.get('unclear'):
+        (rj, checked) = adopt_running_job(new_job)
+        if rj or not checked:
+            return(rj)
+    start = time.time()
+    try:
+        bu_config = {'slaId': new_job['sla_id'], 'isPassthrough': NAS_DA}
+        dprint("NEW JOB CONFIG:" + str(bu_config))
+        bu_status = rubrik.post('v1', '/fileset/' + str(new_job['fs_id']) + "/snapshot", bu_config, timeout=timeout)
+        dprint("JOB: " + str(bu_status))
+        bu_status_url = str(bu_status['links'][0]['href']).split('/')
+        bu_status_path = "/" + "/".join(bu_status_url[5:])
+        nj = {'host': new_job['host'], 'share': new_job['share'], 'cluster': new_job['cluster'], 'status': bu_status_path,
+              'pre': new_job['pre'], 'post': new_job['post']}
+        if 'handle' in new_job:
+            nj['handle'] = new_job['handle']
+        nj['job_id'] = get_job_id(nj)
+        nj['launch_latency'] = time.time() - start
+        if 'queued' in new_job:
+            nj['queue_wait'] = start - new_job['queued']
+        rbk_metrics.observe(metrics, 'job_launch_seconds', nj['launch_latency'], cluster=nj['cluster'])
+        rbk_metrics.observe(metrics, 'job_queue_wait_seconds', nj.get('queue_wait'), cluster=nj['cluster'])
+        rbk_metrics.event(metrics, 'job_launch', host=nj['host'], share=nj['share'], cluster=nj['cluster'], job_id=nj['job_id'],
+                          queue_wait=round(nj.get('queue_wait', 0), 3), launch_latency=round(nj['launch_latency'], 3))
+        return(nj)
+    except Exception as e:
+        sys.stderr.write("Failed to start backup of " + new_job['host'] + ":" + new_job['share'] + ": " + str(e) + "\n")
+        rbk_metrics.event(metrics, 'launch_failed', host=new_job['host'], share=new_job['share'], cluster=new_job['cluster'],
+                          error=str(e), seconds=round(time.time() - start, 3))
+        status = rbk_api.error_status(e)
+        if new_job.get('planned') and status in (400, 404, 422):
+            new_job['planned'] = False
+            j = revalidate_job(new_job)
+            if j is None:
+                new_job['rejected'] = True
+            else:
+                print("Re-resolved " + new_job['host'] + ":" + new_job['share'] + " from the current inventory")
+                for field in ('hs_id', 'sla_id', 'fs_id'):
+                    new_job[field] = j[field]
+                return(launch_job(new_job))
+        elif 400 <= status < 500 and status != 429:
+            new_job['rejected'] = True
+        elif rbk_api.outcome_unknown(e):
+            new_job['unclear'] = True
+        return(None)
+
+def poll_job(job):
+    try:
+        job_status = clusters[job['cluster']]['rubrik'].get('v1', job['status'], timeout=timeout)
+    except rbk_api.CircuitOpenError as e:
+        sys.stderr.write("Can't get status of " + job['host'] + ":" + job['share'] + ": " + str(e) + "\n")
+        job['next_poll'] = time.time() + job['poll']['interval']
+        return(None)
+    except Exception as e:
+        interval = rbk_poll.poll_failed(job['poll'], rbk_api.error_status(e), poll_min, poll_max)
+        if interval is None:
+            sys.stderr.write("Giving up on the status of " + job['host'] + ":" + job['share'] + ": " + str(e) + "\n")
+            return({'status': "STATUS_UNKNOWN"})
+        sys.stderr.write("Can't get status of " + job['host'] + ":" + job['share'] + ": " + str(e) + "\n")
+        job['next_poll'] = time.time() + interval
+        return(None)
+    job['poll']['failures'] = 0
+    return(job_status)
+
+def requeue_job(job_queue, job, job_fail):
+    job['attempts'] = job.get('attempts', 0) + 1
+    if job.get('rejected'):
+        sys.stderr.write("Not retrying " + job['host'] + ":" + job['share'] + ": the cluster rejected the backup\n")
+    elif job['attempts'] < launch_attempts:
+        job_queue.append(job)
+        return
+    else:
+        sys.stderr.write("Giving up on " + job['host'] + ":" + job['share'] + " after " + str(job['attempts']) + " attempts\n")
+    job['status'] = "LAUNCH_FAILED"
+    log_job(journal, job, job['status'])
+    service_update(job, job['status'], True)
+    record_job(job)
+    job_fail.append(job)
+    return
+
+def parse_limits(value):
+    default = 0
+    limits = {}
+    for item in value.split(','):
+        if '=' in item:
+            (host, limit) = item.rsplit('=', 1)
+            limits[host] = int(limit)
+        elif item:
+            default = int(item)
+    return(default, limits)
+
+def pop_next_job(job_queue, host_count, free):
+    if not host_jobs and not host_limits and len(clusters) == 1 and not PRE_HOOKS:
+        return(job_queue.pop(0))
+    best = -1
+    best_count = 0
+    for i in range(len(job_queue)):
+        if free.get(job_queue[i]['cluster'], 0) <= 0:
+            continue
+        if job_queue[i]['pre'] and job_queue[i].get('hook') != 'ready':
+            continue
+        if not host_jobs and not host_limits:
+            return(job_queue.pop(i))
+        host = job_queue[i]['host']
+        count = host_count.get(host, 0)
+        limit = host_limits.get(host, host_jobs)
+        if limit and count >= limit:
+            continue
+        if best < 0 or count < best_count:
+            best = i
+            best_count = count
+            if count == 0:
+                break
+    if best < 0:
+        return(None)
+    return(job_queue.pop(best))
+
+def adjust_job_limit(cluster, job_queue, jobs_running):
+    now = time.time()
+    job_limit = cluster['job_limit']
+    running = [j for j in jobs_running if j['cluster'] == cluster['name']]
+    waiting = [now - j['poll']['start'] for j in running if j['last_status'] in ('QUEUED', 'ACQUIRING')]
+    worst_wait = max(cluster['waits'] + waiting + [0])
+    cluster['waits'] = []
+    latency = cluster['rubrik'].recent_latency()
+    dprint("ADJUST: " + cluster['name'] + " limit=" + str(job_limit) + " wait=" + str(round(worst_wait)) + "s latency=" + str(round(latency, 2)) + "s")
+    if worst_wait > queue_wait or latency > latency_limit or cluster['rubrik'].circuit_open():
+        new_limit = max(min_jobs, job_limit - max(1, job_limit // 4))
+    elif len(running) >= job_limit and job_queue:
+        new_limit = min(cluster['max_jobs'], job_limit + 1)
+    else:
+        new_limit = job_limit
+    if new_limit != job_limit:
+        print("Concurrent job limit: " + cluster_label(cluster) + str(job_limit) + " -> " + str(new_limit))
+    cluster['job_limit'] = new_limit
+    return
+
+def track_restarted_job(j, now):
+    j['next_poll'] = now
+    j['last_status'] = "RUNNING"
+    j['restarted'] = True
+    j['poll'] = rbk_poll.new_poll_state(poll_min)
+    return
+
+def drain_feed(feed, wait, job_queue, jobs_running, job_success):
+    arrived = 0
+    try:
+        if wait > 0:
+            item = feed.get(timeout=wait)
+        else:
+            item = feed.get_nowait()
+        while True:
+            if item is None:
+                return(False, arrived)
+            (kind, payload) = item
+            if kind == 'queue':
+                payload['queued'] = time.time()
+                job_queue.append(payload)
+                arrived += 1
+            elif kind == 'running':
+                track_restarted_job(payload, time.time())
+                jobs_running.append(payload)
+                arrived += 1
+            elif kind == 'completed':
+                job_success.extend(payload)
+                arrived += len(payload)
+            elif kind == 'say':
+                say(*payload)
+            item = feed.get_nowait()
+    except queue.Empty:
+        pass
+    return(True, arrived)
+
+def run_job_hook(kind, job, hook_done):
+    try:
+        result = rbk_hooks.run_hook(job[kind], hook_timeout)
+    except Exception as e:
+        result = {'script': job[kind], 'rc': -1, 'output': str(e), 'timed_out': False, 'time': 0}
+    hook_done.put((kind, job, result))
+    return
+
+def start_hook(hooks, hook_done, kind, job):
+    print("Running " + kind + " script for " + job['host'] + ":" + job['share'])
+    hooks.apply_async(run_job_hook, (kind, job, hook_done))
+    return
+
+def stage_pre_hooks(hooks, hook_done, job_queue, free):
+    lookahead = sum(n for n in free.values() if n > 0) + hook_threads
+    started = 0
+    for j in job_queue[:lookahead]:
+        if j['pre'] and not j.get('hook'):
+            j['hook'] = 'running'
+            start_hook(hooks, hook_done, 'pre', j)
+            started += 1
+    return(started)
+
+def report_hook(kind, job, result):
+    ok = rbk_hooks.hook_ok(result)
+    rbk_metrics.count(metrics, 'hooks_total', kind=kind, result="ok" if ok else "failed")
+    rbk_metrics.observe(metrics, 'hook_seconds', result['time'], kind=kind)
+    rbk_metrics.event(metrics, 'hook', kind=kind, host=job['host'], share=job['share'], rc=result['rc'], timed_out=result['timed_out'],
+                      seconds=round(result['time'], 3))
+    if rbk_hooks.hook_ok(result):
+        dprint(kind.upper() + " " + job['host'] + ":" + job['share'] + " done in " + str(round(result['time'], 1)) + "s")
+        for line in result['output'].splitlines():
+            dprint("\t" + line)
+        return(True)
+    sys.stderr.write(kind.capitalize() + " script for " + job['host'] + ":" + job['share'] + " " + rbk_hooks.hook_error(result) + "\n")
+    for line in result['output'].splitlines():
+        sys.stderr.write("\t" + line + "\n")
+    return(False)
+
+def finish_job(job, job_status, job_success, job_fail):
+    job['status'] = job_status
+    service_update(job, job_status, True)
+    record_job(job)
+    if job_status == "SUCCEEDED":
+        job_success.append(job)
+    else:
+        job_fail.append(job)
+    return
+
+def drain_hooks(hook_done, job_queue, job_success, job_fail):
+    finished = 0
+    while True:
+        try:
+            (kind, job, result) = hook_done.get_nowait()
+        except queue.Empty:
+            return(finished)
+        finished += 1
+        ok = report_hook(kind, job, result)
+        if kind == 'pre' and ok:
+            job['hook'] = 'ready'
+        elif kind == 'pre':
+            job_queue.remove(job)
+            job['status'] = "PRE_FAILED"
+            log_job(journal, job, job['status'])
+            finish_job(job, job['status'], job_success, job_fail)
+        elif ok:
+            finish_job(job, job['last_status'], job_success, job_fail)
+        else:
+            log_job(journal, job, "POST_FAILED")
+            if job['last_status'] == "SUCCEEDED":
+                finish_job(job, "POST_FAILED", job_success, job_fail)
+            else:
+                finish_job(job, job['last_status'], job_success, job_fail)
+
+def run_job_queue(job_queue, jobs_running, job_success, job_fail, feed=None):
+    original_job_queue = len(job_queue) + len(jobs_running) + len(job_success)
+    feed_open = feed is not None
+    report_delay = max(REPORT_DELAY * 60, poll_min)
+    pool = ThreadPool(max(total_jobs(), 1))
+    hooks = ThreadPool(hook_threads)
+    hook_done = queue.Queue()
+    hooks_active = 0
+    now = time.time()
+    last_report = now
+    last_adjust = now
+    last_tick = now
+    last_sample = now
+    slot_busy = 0.0
+    slot_capacity = 0.0
+    for j in job_queue:
+        j['queued'] = now
+    for c in clusters.values():
+        c['launch_hold'] = 0
+        c['waits'] = []
+        c['job_limit'] = c['max_jobs']
+        if ADAPTIVE:
+            c['job_limit'] = max(min_jobs, c['max_jobs'] // 2)
+    for j in jobs_running:
+        track_restarted_job(j, now)
+    while(job_queue or jobs_running or feed_open or hooks_active):
+        if feed_open:
+            (feed_open, arrived) = drain_feed(feed, 0, job_queue, jobs_running, job_success)
+            original_job_queue += arrived
+        if hooks_active:
+            hooks_active -= drain_hooks(hook_done, job_queue, job_success, job_fail)
+        report = False
+        new_jobs = []
+        host_count = {}
+        free = {}
+        for c in clusters.values():
+            if time.time() >= c['launch_hold'] and not c['rubrik'].circuit_open():
+                free[c['name']] = c['job_limit']
+        for j in jobs_running:
+            host_count[j['host']] = host_count.get(j['host'], 0) + 1
+            if j['cluster'] in free:
+                free[j['cluster']] -= 1
+        if PRE_HOOKS:
+            hooks_active += stage_pre_hooks(hooks, hook_done, job_queue, free)
+        while job_queue and [n for n in free if free[n] > 0]:
+            new_job = pop_next_job(job_queue, host_count, free)
+            if new_job is None:
+                break
+            host_count[new_job['host']] = host_count.get(new_job['host'], 0) + 1
+            free[new_job['cluster']] -= 1
+            new_jobs.append(new_job)
+        if new_jobs:
+            report = True
+            for new_job in new_jobs:
+                print ("Starting Backup of " + new_job['host'] + ":" + new_job['share'])
+            for (new_job, nj) in zip(new_jobs, pool.map(launch_job, new_jobs)):
+                if nj:
+                    nj['next_poll'] = time.time() + poll_min
+                    nj['last_status'] = "QUEUED"
+                    nj['poll'] = rbk_poll.new_poll_state(poll_min)
+                    jobs_running.append(nj)
+                    service_update(nj, nj['last_status'])
+                else:
+                    if not new_job.get('rejected'):
+                        clusters[new_job['cluster']]['launch_hold'] = time.time() + poll_min
+                    requeue_job(job_queue, new_job, job_fail)
+        now = time.time()
+        poll_list = [j for j in jobs_running if j['next_poll'] <= now]
+        done_list = []
+        for (j, j_status) in zip(poll_list, pool.map(poll_job, poll_list)):
+            if j_status is None:
+                continue
+            job_status = str(j_status['status'])
+            if job_status == "RUNNING" and j['last_status'] in ('QUEUED', 'ACQUIRING'):
+                j['start_wait'] = time.time() - j['poll']['start']
+                clusters[j['cluster']]['waits'].append(j['start_wait'])
+            j['last_status'] = job_status
+            interval = rbk_poll.next_poll_interval(j['poll'], j_status, poll_min, poll_max)
+            dprint("NEXT POLL: " + j['host'] + ":" + j['share'] + " " + job_status + " in " + str(round(interval)) + "s")
+            j['next_poll'] = time.time() + interval
+            if job_status in running_status_list:
+                service_update(j, job_status)
+                continue
+            j['duration'] = rbk_poll.status_duration(j_status)
+            duration = j['duration']
+            if duration is None and not j.get('restarted'):
+                duration = time.time() - j['poll']['start']
+            log_job(journal, j, job_status, duration)
+            done_list.append(j)
+            if j['post'] and (job_status == "SUCCEEDED" or post_on_fail):
+                service_update(j, job_status)
+                start_hook(hooks, hook_done, 'post', j)
+                hooks_active += 1
+            else:
+                finish_job(j, job_status, job_success, job_fail)
+        slot_limit = sum(c['job_limit'] for c in clusters.values())
+        slot_busy += len(jobs_running) * (now - last_tick)
+        slot_capacity += slot_limit * (now - last_tick)
+        last_tick = now
+        if rbk_metrics.enabled(metrics) and now - last_sample >= metrics_interval:
+            record_slots(slot_busy, slot_capacity)
+            rbk_metrics.event(metrics, 'slots', running=len(jobs_running), queued=len(job_queue), limit=slot_limit, hooks=hooks_active)
+            rbk_metrics.write_prom(metrics)
+            last_sample = now
+        if ADAPTIVE and now - last_adjust >= adjust_delay:
+            for c in clusters.values():
+                adjust_job_limit(c, job_queue, jobs_running)
+            last_adjust = now
+        if now - last_report >= report_delay:
+            report = True
+        if report:
+            last_report = now
+            j_cnt = 0
+            for j in jobs_running:
+                j_cnt += 1
+                print_job_report(j, j['last_status'], j_cnt)
+        if done_list:
+            done_ids = set(id(j) for j in done_list)
+            jobs_running[:] = [j for j in jobs_running if id(j) not in done_ids]
+        if report:
+            print("\tQueued Jobs: " + str(len(job_queue)))
+            if ADAPTIVE:
+                for c in clusters.values():
+                    print("\tJob Limit: " + cluster_label(c) + str(c['job_limit']))
+            job_num = len(job_success) + len(job_fail)
+            pct_done = (job_num / max(original_job_queue, 1)) * 100
+            print("\tQueue Progress: " + str(round(pct_done)) + "%")
+            print('')
+        if done_list and job_queue:
+            continue
+        wake = []
+        if jobs_running:
+            wake.append(min(j['next_poll'] for j in jobs_running))
+        if job_queue:
+            for c in clusters.values():
+                if c['name'] not in free and c['job_limit'] > len([j for j in jobs_running if j['cluster'] == c['name']]):
+                    wake.append(max(c['launch_hold'], c['rubrik'].circuit_until))
+        if feed_open:
+            if wake:
+                wait = max(min(wake) - time.time(), 0)
+            else:
+                wait = poll_min
+            if hooks_active:
+                wait = min(wait, 1)
+            (feed_open, arrived) = drain_feed(feed, wait, job_queue, jobs_running, job_success)
+            original_job_queue += arrived
+        elif hooks_active:
+            try:
+                if wake:
+                    hook_done.put(hook_done.get(timeout=max(min(wake) - time.time(), 0.001)))
+                else:
+                    hook_done.put(hook_done.get())
+            except queue.Empty:
+                pass
+        elif wake:
+            time.sleep(max(min(wake) - time.time(), 0))
+    pool.close()
+    pool.join()
+    hooks.close()
+    hooks.join()
+    record_slots(slot_busy, slot_capacity)
+    return
+
+def record_slots(slot_busy, slot_capacity):
+    rbk_metrics.set_value(metrics, 'slot_busy_seconds_total', round(slot_busy, 3), 'counter')
+    rbk_metrics.set_value(metrics, 'slot_capacity_seconds_total', round(slot_capacity, 3), 'counter')
+    rbk_metrics.set_value(metrics, 'slot_utilization_ratio', round(slot_busy / max(slot_capacity, 1), 4))
+    for c in clusters.values():
+        rbk_metrics.api_stats(metrics, c['rubrik'].snapshot(), rbk_api.LATENCY_BUCKETS, cluster=c['name'])
+    return
+
+def plan_options():
+    return({'nas_host': default_host, 'sla': default_sla, 'fileset': default_fileset, 'pre': default_pre, 'post': default_post,
+            'cluster_map': cluster_map})
+
+def cluster_fingerprint(cluster):
+    return(rbk_plan.fingerprint(cluster['rubrik'], inventory_endpoints(cluster), timeout))
+
+def make_plan(plan_file, infile):
+    start = time.time()
+    print("Resolving " + infile)
+    jobs = resolve_input(infile, default_host, default_sla)
+    planned = {}
+    for (name, cluster) in clusters.items():
+        planned[name] = {'fst_id': cluster['fst_id'], 'fingerprint': cluster_fingerprint(cluster)}
+    new_plan = rbk_plan.new_plan(infile, plan_options(), planned)
+    rbk_plan.add_jobs(new_plan, jobs)
+    rbk_plan.write_plan(plan_file, new_plan)
+    print("Wrote " + str(len(jobs)) + " jobs to " + plan_file + " in " + str(round(time.time() - start, 1)) + "s")
+    rbk_metrics.event(metrics, 'plan_written', plan=plan_file, jobs=len(jobs), seconds=round(time.time() - start, 3))
+    return
+
+def check_plan_cluster(cluster):
+    planned = plan['clusters'][cluster['name']]
+    cluster['fst_id'] = planned['fst_id']
+    cluster['inventory'] = None
+    cluster['loaded'] = 0
+    fingerprint = cluster_fingerprint(cluster)
+    if fingerprint != planned['fingerprint']:
+        print(cluster_label(cluster) + "Inventory has changed since the plan was made.  Jobs the cluster rejects will be re-resolved")
+        dprint("PLAN FINGERPRINT: " + str(planned['fingerprint']) + " NOW: " + str(fingerprint))
+    rbk_metrics.event(metrics, 'plan', cluster=cluster['name'], jobs=len(plan['jobs']), fingerprint_match=fingerprint == planned['fingerprint'])
+    return(cluster)
+
+def revalidate_job(job):
+    with plan_lock:
+        cluster = clusters[job['cluster']]
+        if cluster['inventory'] is None:
+            print(cluster_label(cluster) + "Loading inventory to re-resolve rejected plan entries")
+            cluster['cache'] = rbk_cache.load_cache(cluster['name'], cache_ttl, True)
+            cluster['inventory'] = load_cluster_inventory(cluster)
+            cluster['loaded'] = time.time()
+        j = resolve_job(job['host'], job['share'], [job['sla']], "", job['fst_id'])
+        if j:
+            jobs = fill_new_filesets([j])
+            if jobs:
+                return(jobs[0])
+    return(None)
+
+def service_update(job, status, finished=False):
+    if not service or 'handle' not in job:
+        return
+    rbk_service.update_job(service['table'], job['handle'], status, get_job_id(job), finished)
+    return
+
+def refresh_inventory(cluster):
+    if time.time() - cluster['loaded'] < inventory_refresh:
+        return(False)
+    dprint("Refreshing inventory of " + cluster['name'])
+    rbk_cache.cache_invalidate(cluster['cache'], 'internal:/host/share')
+    rbk_cache.cache_invalidate(cluster['cache'], 'v2:/sla_domain')
+    rbk_cache.cache_invalidate(cluster['cache'], 'v1:/fileset')
+    cluster['inventory'] = load_cluster_inventory(cluster)
+    cluster['loaded'] = time.time()
+    return(True)
+
+def get_submit_fst_id(cluster, fileset):
+    if not fileset:
+        return(cluster['fst_id'])
+    fst_ids = cluster.setdefault('fst_ids', {})
+    if fileset not in fst_ids:
+        fst_ids[fileset] = get_fst_id(cluster['rubrik'], fileset)
+    return(fst_ids[fileset])
+
+def check_submission(item):
+    for field in ('host', 'share', 'sla', 'fileset'):
+        if not isinstance(item.get(field, ""), (type(""), type(u""))):
+            return(field + " must be a string")
+    host = item.get('host', default_host)
+    share = item.get('share', "")
+    sla = item.get('sla', default_sla)
+    if not host or not share or not sla:
+        return("host, share and sla are required")
+    cluster = cluster_for_host(host)
+    if not get_hs_id(cluster['inventory'], host, share) and not (refresh_inventory(cluster) and get_hs_id(cluster['inventory'], host, share)):
+        return("Can't find " + host + ":" + share)
+    if not get_sla_id(cluster['inventory'], sla):
+        return("Can't find SLA: " + sla)
+    if not get_submit_fst_id(cluster, item.get('fileset', "")):
+        return("Can't find fileset template: " + item['fileset'])
+    return("")
+
+def service_script(item, kind):
+    name = item.get(kind, "")
+    if not name:
+        return(True, {'pre': default_pre, 'post': default_post}[kind])
+    if str(name) not in service_scripts:
+        return(False, "Unknown " + kind + " script: " + str(name) + ".  Requests can only name scripts set with --script")
+    return(True, service_scripts[str(name)])
+
+def submission_job(item):
+    error = check_submission(item)
+    hooks = {}
+    for kind in ('pre', 'post'):
+        (ok, script) = service_script(item, kind)
+        if not ok and not error:
+            error = script
+        hooks[kind] = script
+    if error:
+        return(None, error)
+    host = item.get('host', default_host)
+    cluster = cluster_for_host(host)
+    j = resolve_job(host, item['share'], [item.get('sla', default_sla)], "", get_submit_fst_id(cluster, item.get('fileset', "")))
+    if not j:
+        return(None, "Found multiple filesets for " + host + ":" + item['share'])
+    j.update(hooks)
+    return(j, "")
+
+def submit_jobs(items):
+    global PRE_HOOKS
+    output.feed = service['feed']
+    results = []
+    jobs = []
+    with service['lock']:
+        for item in items:
+            try:
+                (j, error) = submission_job(item)
+            except Exception as e:
+                (j, error) = (None, "Can't resolve job: " + str(e))
+            if error:
+                results.append({'error': error})
+                continue
+            if j['pre']:
+                PRE_HOOKS = True
+            rbk_service.add_job(service['table'], j)
+            results.append(j)
+            jobs.append(j)
+        try:
+            created = fill_new_filesets(jobs)
+        except Exception as e:
+            say("Can't create filesets for submitted jobs: " + str(e), True)
+            created = []
+    for j in jobs:
+        if service['table']['closing']:
+            rbk_service.update_job(service['table'], j['handle'], "CANCELLED", finished=True)
+        elif j in created:
+            service['feed'].put(('queue', j))
+        else:
+            rbk_service.update_job(service['table'], j['handle'], "FILESET_FAILED", finished=True)
+    return([r if 'error' in r else rbk_service.get_jobs(service['table'], r['handle']) for r in results])
+
+def service_status():
+    jobs = rbk_service.get_jobs(service['table'])
+    counts = {}
+    for j in jobs:
+        counts[j['status']] = counts.get(j['status'], 0) + 1
+    status = {'jobs': counts, 'clusters': {}}
+    for c in clusters.values():
+        status['clusters'][c['name']] = {'max_jobs': c['max_jobs'], 'job_limit': c.get('job_limit', c['max_jobs']),
+                                        'active': len([j for j in jobs if j['cluster'] == c['name'] and j['status'] in running_status_list]),
+                                        'circuit_open': c['rubrik'].circuit_open()}
+    return(status)
+
+def stop_service(*args):
+    if service['table']['closing']:
+        return
+    print("Shutting down.  Waiting for running jobs to finish")
+    service['table']['closing'] = True
+    threading.Thread(target=service['feed'].put, args=(None,)).start()
+    return
+
+def serve(address, job_success, job_fail):
+    global service
+    service = {'table': rbk_service.new_job_table(), 'lock': threading.Lock(), 'feed': queue.Queue()}
+    rbk_journal.start_run(journal)
+    server = rbk_service.start_server(address, service['table'], submit_jobs, service_status, stop_service)
+    signal.signal(signal.SIGTERM, stop_service)
+    signal.signal(signal.SIGINT, stop_service)
+    print("Taking backup requests on " + address)
+    run_job_queue([], [], job_success, job_fail, service['feed'])
+    rbk_service.stop_server(server, address)
     return
 
 if __name__ == "__main__":
@@ -249,14 +1368,68 @@ if __name__ == "__main__":
     running_status_list = ['RUNNING', 'QUEUED', 'ACQUIRING', 'FINISHING', 'TO_CANCEL']
     RESTART = True
     SORT_ON_TIME = False
-    log_file = "job_log.csv"
+    log_file = "job_log.db"
+    LONGEST_FIRST = False
     REPORT_DELAY = 0
     pct_done = 0.0
-    def_fst_id = ""
+    clusters = {}
+    cluster_map = {}
+    cluster_map_file = ""
+    cluster_jobs = 0
+    cluster_limits = {}
+    SERVE = False
+    serve_address = ""
+    service = None
+    inventory_refresh = 300
+    service_scripts = {}
+    default_pre = ""
+    default_post = ""
+    PRE_HOOKS = False
+    post_on_fail = False
+    hook_threads = 4
+    hook_timeout = 0
+    metrics_json = ""
+    metrics_prom = ""
+    metrics_interval = 60
+    plan_file = ""
+    make_plan_file = ""
+    plan = None
+    plan_lock = threading.Lock()
+    VALIDATE = False
+    profile_prefix = ""
+    page_size = 1000
+    restart_threads = 10
+    pool_size = 0
+    cache_ttl = 0
+    refresh_cache = False
+    poll_min = 10
+    retries = 4
+    retry_budget = 500
+    launch_attempts = 3
+    bulk_size = 100
+    STREAM = False
+    stream_errors = []
+    stream_window = 100
+    ADAPTIVE = False
+    host_jobs = 0
+    host_limits = {}
+    min_jobs = 1
+    queue_wait = 300
+    latency_limit = 5
+    adjust_delay = 60
+    poll_max = 300
 
-    optlist, args = getopt.getopt(sys.argv[1:], 'hDc:t:m:s:Fn:f:dSr:', ['--help', '--DEBUG', '--creds=', '--token=', '--max_jobs=',
-                                                               '--sla=', '--flush', '--nas_host=', '--fileset=', '--nas_da',
-                                                                '--sort_on_time', '--report_time='])
+    optlist, args = getopt.getopt(sys.argv[1:], 'hDc:t:m:s:Fn:f:dSLr:', ['help', 'DEBUG', 'creds=', 'token=', 'max_jobs=',
+                                                               'sla=', 'flush', 'nas_host=', 'fileset=', 'nas_da',
+                                                                'sort_on_time', 'longest_first', 'report_time=', 'page_size=', 'cache_ttl=',
+                                                                'refresh-cache', 'restart_threads=', 'poll_min=', 'poll_max=',
+                                                                'pool_size=', 'retries=', 'retry_budget=', 'launch_attempts=',
+                                                                'adaptive', 'min_jobs=', 'queue_wait=', 'host_jobs=',
+                                                                'bulk_size=', 'stream', 'window=', 'cluster_map=', 'cluster_jobs=',
+                                                                'serve=', 'inventory_refresh=', 'script=', 'pre=', 'post=', 'post_on_fail',
+                                                                'hook_threads=', 'hook_timeout=', 'metrics_json=', 'metrics_prom=',
+                                                                'metrics_interval=', 'plan=', 'make_plan=', 'validate', 'dry-run',
+                                                                'profile='])
     for opt, a in optlist:
         if opt in ('-h', '--help'):
             usage()
@@ -280,92 +1453,159 @@ if __name__ == "__main__":
             NAS_DA = True
         if opt in ('-S', '--sort_on_time'):
             SORT_ON_TIME = True
+        if opt in ('-L', '--longest_first'):
+            LONGEST_FIRST = True
         if opt in ('-r', '--report_time'):
             REPORT_DELAY = int(a)
+        if opt == '--page_size':
+            page_size = int(a)
+        if opt == '--stream':
+            STREAM = True
+        if opt == '--window':
+            stream_window = int(a)
+        if opt == '--bulk_size':
+            bulk_size = int(a)
+        if opt == '--metrics_json':
+            metrics_json = a
+        if opt == '--metrics_prom':
+            metrics_prom = a
+        if opt == '--metrics_interval':
+            metrics_interval = int(a)
+        if opt == '--pre':
+            default_pre = a
+        if opt == '--post':
+            default_post = a
+        if opt == '--post_on_fail':
+            post_on_fail = True
+        if opt == '--hook_threads':
+            hook_threads = int(a)
+        if opt == '--hook_timeout':
+            hook_timeout = int(a)
+        if opt == '--serve':
+            SERVE = True
+            serve_address = a
+        if opt == '--script':
+            (name, script) = a.split('=', 1)
+            service_scripts[name] = script
+        if opt == '--inventory_refresh':
+            inventory_refresh = int(a)
+        if opt == '--cluster_map':
+            cluster_map_file = a
+        if opt == '--cluster_jobs':
+            (cluster_jobs, cluster_limits) = parse_limits(a)
+        if opt == '--host_jobs':
+            (host_jobs, host_limits) = parse_limits(a)
+        if opt == '--adaptive':
+            ADAPTIVE = True
+        if opt == '--min_jobs':
+            min_jobs = int(a)
+        if opt == '--queue_wait':
+            queue_wait = int(a)
+        if opt == '--retries':
+            retries = int(a)
+        if opt == '--retry_budget':
+            retry_budget = int(a)
+        if opt == '--launch_attempts':
+            launch_attempts = int(a)
+        if opt == '--pool_size':
+            pool_size = int(a)
+        if opt == '--restart_threads':
+            restart_threads = int(a)
+        if opt == '--poll_min':
+            poll_min = int(a)
+        if opt == '--poll_max':
+            poll_max = int(a)
+        if opt == '--cache_ttl':
+            cache_ttl = int(a)
+        if opt == '--refresh-cache':
+            refresh_cache = True
+        if opt == '--plan':
+            plan_file = a
+        if opt == '--make_plan':
+            make_plan_file = a
+        if opt in ('--validate', '--dry-run'):
+            VALIDATE = True
+        if opt == '--profile':
+            profile_prefix = a
 
     try:
-        (infile, rubrik_host) = args
+        if SERVE:
+            (rubrik_host,) = args
+            infile = None
+        else:
+            (infile, rubrik_host) = args
     except:
         usage()
-    sleep_cycles = REPORT_DELAY*60/10
-    if token:
-        rubrik = rubrik_cdm.Connect(rubrik_host, api_token=token)
+    rubrik_hosts = [h for h in rubrik_host.split(',') if h]
+    if SERVE:
+        import rbk_service
+        error = rbk_service.address_error(serve_address)
+        if error:
+            sys.stderr.write("--serve: " + error + "\n")
+            exit(1)
+    if cluster_map_file:
+        cluster_map = read_cluster_map(cluster_map_file)
+        for name in cluster_map.values():
+            if name not in rubrik_hosts:
+                rubrik_hosts.append(name)
+    if not pool_size:
+        pool_size = max(max_jobs, restart_threads)
+    if (plan_file or make_plan_file) and SERVE:
+        sys.stderr.write("--plan and --make_plan can't be used with --serve\n")
+        exit(1)
+    if VALIDATE:
+        exit(validate_run(infile))
+    if SERVE:
+        run_clusters = rubrik_hosts
+    elif default_host:
+        run_clusters = job_clusters([default_host])
     else:
+        try:
+            run_clusters = job_clusters(host for (host, share, lf, hooks) in read_input(infile, default_host))
+        except (IOError, OSError) as e:
+            sys.stderr.write("Can't read " + infile + ": " + str(e) + "\n")
+            exit(2)
+    if plan_file:
+        try:
+            plan = rbk_plan.read_plan(plan_file)
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("Can't read plan " + plan_file + ": " + str(e) + "\n")
+            exit(2)
+        problems = rbk_plan.plan_problems(plan, infile, plan_options(), run_clusters)
+        if problems:
+            sys.stderr.write("Plan " + plan_file + " is out of date: " + "; ".join(problems) + ".  Rebuild it with --make_plan\n")
+            exit(2)
+    if not token:
         if not user:
             user = python_input("User: ")
         if not password:
             password = getpass.getpass("Password: ")
-        rubrik = rubrik_cdm.Connect(rubrik_host, user, password)
-    if default_fileset:
-        def_fst_id = get_fst_id(rubrik, default_fileset)
-        if not def_fst_id:
-            sys.stderr.write("Can't find default fileset template: " + default_fileset + "\n")
-            exit(2)
-    hs_data = rubrik.get('internal', '/host/share', timeout=timeout)
-    if DEBUG:
-        print("HOST=" + default_host)
-        for h in hs_data['data']:
-            if h['hostname'] == default_host:
-               print("FOUND " + h['hostname'] + ":" + h['exportPoint'])
-    if hs_data['total'] == 0:
-        sys.stderr.write("No NAS Shares found.\n")
-        exit(1)
-    sla_data = rubrik.get('v2', '/sla_domain', timeout=timeout)
-    if sla_data['total'] == 0:
-        sys.stderr.write("No SLAs found?!\n")
-        exit(2)
-    fs_data = rubrik.get('v1', '/fileset', timeout=timeout)
-    if fs_data['total'] == 0:
-        sys.stderr.write("No Filesets found\n")
-        exit(3)
-    (job_queue, jobs_running, job_success) = get_job_queue(hs_data, sla_data, fs_data, infile, default_host, default_sla, def_fst_id)
-    original_job_queue = len(job_queue) + len(jobs_running) + len(job_success)
-    report_cycle = 0
-    while(job_queue or jobs_running):
-        report_cycle += 1
-        if report_cycle > sleep_cycles:
-            report_cycle = 1
-        if (len(jobs_running) < max_jobs) and job_queue:
-            try:
-                report_cycle = 1
-                new_job = job_queue.pop(0)
-                print ("Starting Backup of " + new_job['host'] + ":" + new_job['share'])
-                bu_config = {'slaId': new_job['sla_id'], 'isPassthrough': NAS_DA}
-                dprint("NEW JOB CONFIG:" + str(bu_config))
-                bu_status = rubrik.post('v1', '/fileset/' + str(new_job['fs_id']) + "/snapshot", bu_config, timeout=timeout)
-                dprint("JOB: " + str(bu_status))
-                bu_status_url = str(bu_status['links'][0]['href']).split('/')
-                bu_status_path = "/" + "/".join(bu_status_url[5:])
-                jobs_running.append({'host': new_job['host'], 'share': new_job['share'], 'status': bu_status_path})
-            except:
-                pass
-        remove_queue = []
-        j_cnt = 0
-        for j in jobs_running:
-            j_cnt += 1
-            j_status = rubrik.get('v1', j['status'], timeout=timeout)
-            job_status = str(j_status['status'])
-            if report_cycle == 1:
-                print_job_report(j, job_status, j_cnt)
-            if job_status in running_status_list:
-                continue
-            else:
-                log_job(log_file, j, job_status)
-                j['status'] = job_status
-                if job_status == "SUCCEEDED":
-                    job_success.append(j)
-                else:
-                    job_fail.append(j)
-                remove_queue.append(j)
-        for rj in remove_queue:
-            jobs_running.remove(rj)
-        if report_cycle == 1:
-            print("\tQueued Jobs: " + str(len(job_queue)))
-            job_num = len(job_success) + len(job_fail)
-            pct_done = (job_num / original_job_queue) * 100
-            print("\tQueue Progress: " + str(round(pct_done)) + "%")
-            print('')
-        time.sleep(10)
+    journal = rbk_journal.open_journal(log_file, "job_log.csv")
+    metrics = rbk_metrics.new_metrics(metrics_json, metrics_prom, "rbk_concurrent_nas_backup")
+    rbk_metrics.event(metrics, 'run_start', clusters=rubrik_hosts, max_jobs=max_jobs, adaptive=ADAPTIVE, stream=STREAM, serve=SERVE)
+    profile = rbk_profile.new_profile(profile_prefix)
+    rbk_profile.start_phase(profile, 'inventory')
+    for name in run_clusters:
+        clusters[name] = connect_cluster(name)
+    if make_plan_file:
+        rbk_profile.start_phase(profile, 'get_job_queue')
+        make_plan(make_plan_file, infile)
+    elif SERVE:
+        rbk_profile.start_phase(profile, 'main_loop')
+        serve(serve_address, job_success, job_fail)
+    elif STREAM and not plan:
+        rbk_profile.start_phase(profile, 'main_loop')
+        feed = queue.Queue()
+        producer = threading.Thread(target=stream_job_queue, args=(infile, default_host, default_sla, feed))
+        producer.daemon = True
+        producer.start()
+        run_job_queue([], [], job_success, job_fail, feed)
+    else:
+        rbk_profile.start_phase(profile, 'get_job_queue')
+        (job_queue, jobs_running, job_success) = get_job_queue(infile, default_host, default_sla)
+        rbk_profile.start_phase(profile, 'main_loop')
+        run_job_queue(job_queue, jobs_running, job_success, job_fail)
+    rbk_profile.end_phase(profile)
     if job_fail:
         print(str(len(job_fail)) + " Failed Job", end='')
         if len(job_fail) == 1:
@@ -374,4 +1614,16 @@ if __name__ == "__main__":
             print('s:')
         for fj in job_fail:
             print("\t" + fj['host'] + ":" + fj['share'] + " : " + fj['status'])
+    for error in stream_errors:
+        sys.stderr.write(error + "\n")
+    rbk_metrics.event(metrics, 'run_end', succeeded=len(job_success), failed=len(job_fail), errors=stream_errors,
+                      seconds=round(time.time() - metrics['start'], 3))
+    rbk_metrics.close_metrics(metrics)
+    for c in clusters.values():
+        api_summary = c['rubrik'].summary()
+        print(cluster_label(c) + api_summary[0])
+        for line in api_summary[1:]:
+            dprint(line)
+    if stream_errors:
+        exit(1)
     print("\nDone!")
\ No newline at end of file
@@ -0,0 +1,46 @@
+import os
+import time
+import signal
+import threading
+import subprocess
+
+# Pre and post backup scripts for rbk_concurrent_nas_backup.py.  Each script runs in its own shell
+# (and process group so a timeout takes down anything it started) with stdout and stderr captured
+# together.  The caller runs these from a thread pool so a slow script never holds up the scheduler.
+
+def run_hook(script, timeout=0):
+    start = time.time()
+    if hasattr(os, 'setsid'):
+        proc = subprocess.Popen(script, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+    else:
+        proc = subprocess.Popen(script, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    expired = []
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill_hook, (proc, expired))
+        timer.daemon = True
+        timer.start()
+    output = proc.communicate()[0]
+    if timer:
+        timer.cancel()
+    return({'script': script, 'rc': proc.returncode, 'output': output.decode('utf-8', 'replace'), 'timed_out': bool(expired),
+            'time': time.time() - start})
+
+def kill_hook(proc, expired):
+    expired.append(True)
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
+    return
+
+def hook_ok(result):
+    return(result['rc'] == 0 and not result['timed_out'])
+
+def hook_error(result):
+    if result['timed_out']:
+        return("timed out after " + str(round(result['time'])) + "s")
+    return("exited with " + str(result['rc']))
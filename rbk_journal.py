@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# Append-only job journal for rbk_concurrent_nas_backup.py.  Every finished job is one row in a SQLite
+# database in WAL mode, committed as it is written, so a killed run never leaves a half written log.
+# Rows are grouped into runs: a new run starts whenever the script starts a fresh pass over its input
+# file and a restarted run keeps appending to the current one.  Rows are indexed by (host, share) and
+# carry the job ID and run time so restart checks and longest-first ordering don't rescan a text file.
+
+SCHEMA = ("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, run INTEGER NOT NULL, "
+          "host TEXT NOT NULL, share TEXT NOT NULL, status TEXT NOT NULL, date TEXT NOT NULL, job_id TEXT, duration REAL)",
+          "CREATE INDEX IF NOT EXISTS journal_share ON journal (host, share)",
+          "CREATE INDEX IF NOT EXISTS journal_run ON journal (run)",
+          "CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY AUTOINCREMENT, started TEXT NOT NULL)")
+
+def open_journal(db_file, csv_file=""):
+    new_db = not os.path.isfile(db_file)
+    db = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=FULL")
+    for statement in SCHEMA:
+        db.execute(statement)
+    journal = {'db': db, 'lock': threading.Lock(), 'run': 0}
+    row = db.execute("SELECT MAX(run) FROM runs").fetchone()
+    if row[0]:
+        journal['run'] = row[0]
+    else:
+        start_run(journal)
+    if new_db and csv_file and os.path.isfile(csv_file):
+        import_csv(journal, csv_file)
+    return(journal)
+
+def import_csv(journal, csv_file):
+    with open(csv_file) as fp:
+        for line in fp:
+            line = line.rstrip()
+            if not line:
+                continue
+            (host, share, status, date) = line.split(',')
+            with journal['lock']:
+                journal['db'].execute("INSERT INTO journal (run, host, share, status, date) VALUES (?, ?, ?, ?, ?)",
+                                      (journal['run'], host, share, status, date))
+    return
+
+def start_run(journal):
+    with journal['lock']:
+        cur = journal['db'].execute("INSERT INTO runs (started) VALUES (?)", (datetime.now().strftime("%Y-%m-%dT%H:%M"),))
+        journal['run'] = cur.lastrowid
+    return(journal['run'])
+
+def log_job(journal, host, share, status, job_id="", duration=None):
+    date_s = datetime.now().strftime("%Y-%m-%dT%H:%M")
+    with journal['lock']:
+        journal['db'].execute("INSERT INTO journal (run, host, share, status, date, job_id, duration) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (journal['run'], host, share, status, date_s, job_id, duration))
+    return
+
+def done_jobs(journal):
+    done = {}
+    with journal['lock']:
+        rows = journal['db'].execute("SELECT host, share, date FROM journal WHERE run = ? AND status = 'SUCCEEDED'",
+                                     (journal['run'],)).fetchall()
+    for (host, share, date) in rows:
+        done[(host, share)] = date
+    return(done)
+
+def job_durations(journal):
+    with journal['lock']:
+        rows = journal['db'].execute("SELECT host, share, AVG(duration) FROM journal WHERE status = 'SUCCEEDED' AND duration IS NOT NULL "
+                                     "GROUP BY host, share").fetchall()
+    return(dict(((host, share), avg) for (host, share, avg) in rows))
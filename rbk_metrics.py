@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import threading
+
+# Run metrics for rbk_nas_backup.py and rbk_concurrent_nas_backup.py.  Events are appended to a
+# JSON-lines file as they happen, one object per line with a timestamp, the script and an event
+# name, so a night's run can be replayed job by job.  Totals are kept in memory and written as a
+# Prometheus textfile (atomically, for node_exporter's textfile collector) whenever the script
+# asks and at the end of the run.  With neither file set every call is a cheap no-op.
+
+PREFIX = "rbk_nas_"
+METRIC_HELP = {
+    'jobs_total': "Backup jobs finished, by final status",
+    'job_queue_wait_seconds': "Time a job waited in the script's queue before it was launched",
+    'job_launch_seconds': "Time taken by the API call that starts a backup",
+    'job_start_wait_seconds': "Time a launched job stayed QUEUED/ACQUIRING on the cluster",
+    'job_run_seconds': "Time the cluster ran the job, from the startTime to the endTime in its status",
+    'hook_seconds': "Run time of pre and post scripts",
+    'hooks_total': "Pre and post scripts run, by result",
+    'inventory_load_seconds': "Time taken to load the share, SLA and fileset inventory",
+    'slot_busy_seconds_total': "Sum over time of the number of running backup jobs",
+    'slot_capacity_seconds_total': "Sum over time of the number of backup slots allowed",
+    'slot_utilization_ratio': "Busy slot time over allowed slot time for the run",
+    'api_calls_total': "Rubrik API calls made",
+    'api_errors_total': "Rubrik API calls that failed",
+    'api_retries_total': "Rubrik API calls that were retried",
+    'api_latency_seconds': "Latency of Rubrik API calls",
+    'run_seconds': "Time since the run started",
+    'run_start_timestamp_seconds': "Unix time the run started",
+}
+
+def new_metrics(events_file="", prom_file="", script=""):
+    metrics = {'lock': threading.Lock(), 'events': None, 'prom_file': prom_file, 'script': script, 'start': time.time(), 'series': {}}
+    if events_file:
+        metrics['events'] = open(events_file, 'a')
+    return(metrics)
+
+def enabled(metrics):
+    return(metrics['events'] is not None or bool(metrics['prom_file']))
+
+def event(metrics, name, **fields):
+    if metrics['events'] is None:
+        return
+    record = {'ts': round(time.time(), 3), 'script': metrics['script'], 'event': name}
+    record.update(fields)
+    line = json.dumps(record, sort_keys=True)
+    with metrics['lock']:
+        metrics['events'].write(line + "\n")
+        metrics['events'].flush()
+    return
+
+def series(metrics, name, mtype):
+    return(metrics['series'].setdefault(name, {'type': mtype, 'values': {}}))
+
+def label_key(labels):
+    return(tuple(sorted((k, str(v)) for (k, v) in labels.items())))
+
+def count(metrics, name, value=1, **labels):
+    if not metrics['prom_file']:
+        return
+    with metrics['lock']:
+        values = series(metrics, name, 'counter')['values']
+        key = label_key(labels)
+        values[key] = values.get(key, 0) + value
+    return
+
+def set_value(metrics, name, value, mtype='gauge', **labels):
+    if not metrics['prom_file']:
+        return
+    with metrics['lock']:
+        series(metrics, name, mtype)['values'][label_key(labels)] = value
+    return
+
+def observe(metrics, name, value, **labels):
+    if not metrics['prom_file'] or value is None:
+        return
+    with metrics['lock']:
+        values = series(metrics, name, 'summary')['values']
+        key = label_key(labels)
+        (total, n) = values.get(key, (0.0, 0))
+        values[key] = (total + value, n + 1)
+    return
+
+def api_stats(metrics, stats, buckets, **labels):
+    set_value(metrics, 'api_calls_total', stats['calls'], 'counter', **labels)
+    set_value(metrics, 'api_errors_total', stats['errors'], 'counter', **labels)
+    set_value(metrics, 'api_retries_total', stats['retries'], 'counter', **labels)
+    set_value(metrics, 'api_latency_seconds', (list(buckets), list(stats['buckets']), stats['time'], stats['calls']), 'histogram', **labels)
+    return
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    return("{" + ",".join(k + '="' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for (k, v) in pairs) + "}")
+
+def prom_lines(metrics):
+    lines = []
+    with metrics['lock']:
+        names = sorted(metrics['series'])
+        all_series = dict((n, dict(metrics['series'][n]['values'])) for n in names)
+        types = dict((n, metrics['series'][n]['type']) for n in names)
+    script = (('script', metrics['script']),)
+    for name in names:
+        full = PREFIX + name
+        lines.append("# HELP " + full + " " + METRIC_HELP.get(name, name))
+        lines.append("# TYPE " + full + " " + types[name])
+        for key in sorted(all_series[name]):
+            value = all_series[name][key]
+            key = script + key
+            if types[name] == 'summary':
+                lines.append(full + "_sum" + format_labels(key) + " " + repr(float(value[0])))
+                lines.append(full + "_count" + format_labels(key) + " " + str(value[1]))
+            elif types[name] == 'histogram':
+                (bounds, counts, total, n) = value
+                cumulative = 0
+                for i in range(len(bounds)):
+                    cumulative += counts[i]
+                    lines.append(full + "_bucket" + format_labels(key, (('le', str(bounds[i])),)) + " " + str(cumulative))
+                lines.append(full + "_bucket" + format_labels(key, (('le', "+Inf"),)) + " " + str(n))
+                lines.append(full + "_sum" + format_labels(key) + " " + repr(float(total)))
+                lines.append(full + "_count" + format_labels(key) + " " + str(n))
+            else:
+                lines.append(full + format_labels(key) + " " + repr(value))
+    return(lines)
+
+def write_prom(metrics):
+    if not metrics['prom_file']:
+        return
+    set_value(metrics, 'run_start_timestamp_seconds', round(metrics['start'], 3))
+    set_value(metrics, 'run_seconds', round(time.time() - metrics['start'], 3))
+    tmp_file = metrics['prom_file'] + ".tmp"
+    with open(tmp_file, 'w') as fp:
+        fp.write("\n".join(prom_lines(metrics)) + "\n")
+    os.rename(tmp_file, metrics['prom_file'])
+    return
+
+def close_metrics(metrics):
+    write_prom(metrics)
+    if metrics['events'] is not None:
+        metrics['events'].close()
+        metrics['events'] = None
+    return
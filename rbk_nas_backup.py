@@ -1,22 +1,270 @@
 #!/usr/bin/python
 
 from __future__ import print_function
-import rubrik_cdm
 import getopt
 import sys
 import getpass
-import urllib3
 import time
 import subprocess
+import rbk_api
+import rbk_cache
+import rbk_poll
+import rbk_metrics
+import rbk_profile
+from multiprocessing.pool import ThreadPool
 from codecs import decode
-urllib3.disable_warnings()
+
+PAGE_SIZE = 1000
+
+def get_pages (rubrik, api, endpoint, fields):
+  data = []
+  if '?' in endpoint:
+    sep = '&'
+  else:
+    sep = '?'
+  while True:
+    page = rubrik.get(api, endpoint + sep + "limit=" + str(PAGE_SIZE) + "&offset=" + str(len(data)))
+    data += [dict((k, x[k]) for k in fields if k in x) for x in page['data']]
+    if not page['data'] or not page.get('hasMore', False):
+      break
+  return (data)
+
+def cached_get (rubrik, cache, api, endpoint, fields):
+  key = api + ":" + endpoint
+  data = rbk_cache.cache_get(cache, key)
+  if data is not None:
+    return ({'data': data, 'total': len(data)})
+  data = get_pages(rubrik, api, endpoint, fields)
+  rbk_cache.cache_put(cache, key, data)
+  return ({'data': data, 'total': len(data)})
 
 def get_sla_data (rubrik, vers, name):
-  sla_data = rubrik.get('v1', str("/sla_domain?primary_cluster=local&name=" + name))
+  sla_data = cached_get(rubrik, cache, 'v1', str("/sla_domain?primary_cluster=local&name=" + name), ('id', 'name'))
   if sla_data['total'] == 0 and vers > 4:
-    sla_data = rubrik.get('v2', str("/sla_domain?primary_cluster=local&name=" + name))
+    sla_data = cached_get(rubrik, cache, 'v2', str("/sla_domain?primary_cluster=local&name=" + name), ('id', 'name'))
   return (sla_data)
 
+def read_targets (backup_file):
+  targets = []
+  with open(backup_file) as fp:
+    for line in fp:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      lf = line.split(',')
+      t = new_target(lf[0])
+      for field in lf[1:]:
+        for kind in ('pre', 'post'):
+          if field.startswith(kind + '='):
+            t[kind] = field[len(kind) + 1:]
+      targets.append(t)
+  return (targets)
+
+def new_target (backup):
+  (host, share) = backup.split(':', 1)
+  return ({'host': host, 'share': share, 'name': backup, 'pre': pre_script, 'post': post_script, 'status': "", 'duration': None})
+
+def target_label (t):
+  if len(targets) > 1:
+    return (t['name'] + " ")
+  return ("")
+
+def run_script (kind, t):
+  print(target_label(t) + "Executing " + t[kind])
+  hook_start = time.time()
+  rc = subprocess.call(t[kind], shell=True)
+  rbk_metrics.observe(metrics, 'hook_seconds', time.time() - hook_start, kind=kind)
+  rbk_metrics.event(metrics, 'hook', kind=kind, host=t['host'], share=t['share'], rc=rc, seconds=round(time.time() - hook_start, 3))
+  return (rc)
+
+def find_sla (name):
+  if name not in sla_ids:
+    sla_ids[name] = ""
+    sla_data = get_sla_data (rubrik, version_maj, name)
+    for s in sla_data['data']:
+      if s['name'] == name:
+        sla_ids[name] = s['id']
+        break
+  return (sla_ids[name])
+
+def find_template (share_type):
+  if share_type not in template_ids:
+    template_ids[share_type] = ""
+    fst_data = rubrik.get('v1', str("/fileset_template?share_type=" + share_type + "&name=" + fileset))
+    for t in fst_data['data']:
+      if t['name'] == fileset:
+        template_ids[share_type] = t['id']
+        break
+  return (template_ids[share_type])
+
+def find_fileset (share_id):
+  if fs_index is not None:
+    return (fs_index.get(share_id))
+  fs_data = cached_get(rubrik, cache, 'v1', str("/fileset?share_id=" + share_id + "&name=" + fileset),
+                       ('id', 'configuredSlaDomainId', 'configuredSlaDomainName'))
+  if fs_data['data']:
+    return (fs_data['data'][0])
+  return (None)
+
+def resolve_target (t):
+  global sla
+  t['share_id'] = hs_index.get((t['host'], t['share']), "")
+  if t['share_id'] == "":
+    return ("Share not found")
+  fs = find_fileset(t['share_id'])
+  if fs:
+    t['fs_id'] = fs['id']
+    if sla == "":
+      t['sla_id'] = fs['configuredSlaDomainId']
+      t['sla_name'] = fs['configuredSlaDomainName']
+      return ("")
+  else:
+    if t['share'].startswith("/"):
+      share_type = "NFS"
+    else:
+      share_type = "SMB"
+    template_id = find_template(share_type)
+    if template_id == "":
+      return ("Fileset not found")
+    if sla == "":
+      if int(sys.version[0]) < 3:
+        sla = raw_input ("SLA Domain: ")
+      else:
+        sla = input("SLA Domain: ")
+  t['sla_id'] = find_sla(sla)
+  t['sla_name'] = sla
+  if t['sla_id'] == "":
+    return ("Can't find SLA: " + sla)
+  if not fs:
+    fs_config = {"shareId" : str(t['share_id']), "templateId": str(template_id), "slaID" : str(t['sla_id'])}
+    fs_create = rubrik.post('v1', '/fileset', fs_config)
+    rbk_cache.cache_invalidate(cache, 'v1:/fileset')
+    t['fs_id'] = fs_create['id']
+    t['fileset_created'] = True
+  return ("")
+
+def start_target (t):
+  if t['pre']:
+    run_script('pre', t)
+  print(target_label(t) + "Starting Backup...")
+  bu_config = {"slaId" : str(t['sla_id']), "isPassthrough": direct_archive}
+  launch_start = time.time()
+  try:
+    bu_status = rubrik.post ('v1', '/fileset/' + str(t['fs_id']) + "/snapshot", bu_config)
+  except Exception as e:
+    if len(targets) == 1:
+      raise
+    sys.stderr.write(target_label(t) + "Failed to start backup: " + str(e) + "\n")
+    t['status'] = "LAUNCH_FAILED"
+    return (t)
+  bu_status_url = str(bu_status['links'][0]['href']).split('/')
+  t['status_path'] = "/" + "/".join(bu_status_url[5:])
+  t['job_id'] = bu_status_url[-1]
+  t['launch_latency'] = time.time() - launch_start
+  t['start_wait'] = None
+  t['poll'] = rbk_poll.new_poll_state(poll_min)
+  t['next_poll'] = time.time()
+  rbk_metrics.observe(metrics, 'job_launch_seconds', t['launch_latency'], cluster=rubrik_cluster)
+  rbk_metrics.event(metrics, 'job_launch', host=t['host'], share=t['share'], cluster=rubrik_cluster, job_id=t['job_id'],
+                    launch_latency=round(t['launch_latency'], 3))
+  return (t)
+
+def poll_target (t):
+  try:
+    bu_job_status = rubrik.get ('v1', t['status_path'])
+  except rbk_api.CircuitOpenError as e:
+    sys.stderr.write (target_label(t) + "Can't get status: " + str(e) + "\n")
+    t['next_poll'] = time.time() + poll_min
+    return (False)
+  except Exception as e:
+    interval = rbk_poll.poll_failed(t['poll'], rbk_api.error_status(e), poll_min, poll_max)
+    if interval is None:
+      sys.stderr.write (target_label(t) + "Giving up on the job status: " + str(e) + "\n")
+      t['status'] = "STATUS_UNKNOWN"
+      return (True)
+    sys.stderr.write (target_label(t) + "Can't get status: " + str(e) + "\n")
+    t['next_poll'] = time.time() + interval
+    return (False)
+  t['poll']['failures'] = 0
+  print(target_label(t) + "STATUS: " + str(bu_job_status))
+  bu_status = str(bu_job_status['status'])
+  t['status'] = bu_status
+  t['duration'] = rbk_poll.status_duration(bu_job_status)
+  if bu_status == "RUNNING" and t['start_wait'] is None:
+    t['start_wait'] = time.time() - t['poll']['start']
+  if bu_status == "RUNNING" or bu_status == "QUEUED" or bu_status == "ACQUIRING" or bu_status == "FINISHING":
+    t['next_poll'] = time.time() + rbk_poll.next_poll_interval(t['poll'], bu_job_status, poll_min, poll_max)
+    return (False)
+  elif bu_status == "SUCCEEDED":
+    return (True)
+  elif bu_status == "TO_CANCEL" or 'endTime' in bu_job_status:
+    sys.stderr.write (target_label(t) + "Job ended with status: " + str(bu_job_status['status']) + "\n")
+    return (True)
+  print(target_label(t) + "Status = " + bu_status)
+  t['next_poll'] = time.time() + poll_min
+  return (False)
+
+def finish_target (t):
+  duration = t['duration']
+  if duration is not None:
+    duration = round(duration, 3)
+  rbk_metrics.count(metrics, 'jobs_total', status=t['status'], cluster=rubrik_cluster)
+  rbk_metrics.observe(metrics, 'job_start_wait_seconds', t['start_wait'], cluster=rubrik_cluster)
+  rbk_metrics.observe(metrics, 'job_run_seconds', duration, cluster=rubrik_cluster, status=t['status'])
+  rbk_metrics.event(metrics, 'job_done', host=t['host'], share=t['share'], cluster=rubrik_cluster, status=t['status'], job_id=t['job_id'],
+                    launch_latency=round(t['launch_latency'], 3), start_wait=t['start_wait'] and round(t['start_wait'], 3),
+                    duration=duration)
+  if t['post'] and t['status'] == "SUCCEEDED":
+    run_script('post', t)
+  return (t)
+
+def validate_run ():
+  problems = []
+  warnings = []
+  if len(args) != 1:
+    problems.append("expected one rubrik argument")
+  if threads < 1:
+    problems.append("--threads must be at least 1")
+  if poll_min < 1 or poll_max < poll_min:
+    problems.append("need 1 <= --poll_min <= --poll_max")
+  names = list(backups)
+  if backup_file:
+    try:
+      names += [t['name'] for t in read_targets(backup_file)]
+    except (IOError, OSError) as e:
+      problems.append(str(e))
+    except ValueError:
+      problems.append(backup_file + ": every line must start with host:share")
+  seen = set()
+  for name in names:
+    if ':' not in name or name.startswith(':') or name.endswith(':'):
+      problems.append("expected host:share: " + name)
+    elif name in seen:
+      warnings.append(name + " is listed more than once")
+    seen.add(name)
+  for (value, prompt) in ((names, "the backup"), (fileset, "the fileset"), (user, "the user"), (password, "the password")):
+    if not value:
+      warnings.append("the run will prompt for " + prompt)
+  if args and not problems:
+    entries = rbk_cache.cached_entries(args[0])
+    shares = entries.get('internal:/host/share')
+    if shares:
+      inventory = set(x['hostname'] + ":" + x['exportPoint'] for x in shares['data'])
+      for name in names:
+        if name not in inventory:
+          warnings.append(name + " is not in the cached inventory of " + args[0])
+    sla_key = "v1:/sla_domain?primary_cluster=local&name=" + sla
+    if sla and sla_key in entries and not [x for x in entries[sla_key]['data'] if x['name'] == sla]:
+      warnings.append("SLA " + sla + " is not in the cached inventory of " + args[0])
+  for m in warnings:
+    sys.stderr.write("WARNING: " + m + "\n")
+  for m in problems:
+    sys.stderr.write("ERROR: " + m + "\n")
+  if problems:
+    return (2)
+  print(str(len(names)) + " backups OK")
+  return (0)
+
 def get_creds_from_file(file):
   with open(file) as fp:
     data = fp.read()
@@ -42,28 +290,47 @@ def get_creds_from_file(file):
 
 
 def usage ():
-  sys.stderr.write ("Usage: rbk_nas_backup.py [-b host:share] [-f fileset] [-c user:password] [-P pre_script] [-p post_script] [-h] rubrik\n")
-  sys.stderr.write("-b | --backup= : specify a host and a share/export\n")
+  sys.stderr.write ("Usage: rbk_nas_backup.py [-b host:share]... [--backup_file=file] [-f fileset] [-c user:password] [-P pre_script] [-p post_script] [--poll_min=secs] [--poll_max=secs] [--cache_ttl=minutes] [--refresh-cache] [--metrics_json=file] [--metrics_prom=file] [--threads=n] [--validate] [--profile=prefix] [-h] rubrik\n")
+  sys.stderr.write("-b | --backup= : specify a host and a share/export.  Repeat to back up several shares together\n")
+  sys.stderr.write("--backup_file= : File of host:share lines to back up together.  Add ,pre=script and/or ,post=script to a line to override -P/-p for that share\n")
   sys.stderr.write("-f | --fileset= : specify a fileset\n")
   sys.stderr.write("-c | --creds= : specify a Rubrik user:passwd.  Note: This is not secure\n")
   sys.stderr.write("-P | --pre= : Specify a script to run before the backup\n")
   sys.stderr.write("-p | --post= : Specify a script to run after the backup\n")
+  sys.stderr.write("--threads= : Number of shares whose pre scripts and backup launches run at once [default: 10]\n")
+  sys.stderr.write("--poll_min= : Shortest time between status checks in seconds [default: 5]\n")
+  sys.stderr.write("--poll_max= : Longest time between status checks of a long running backup in seconds [default: 300]\n")
+  sys.stderr.write("--cache_ttl= : Cache share, SLA and fileset lookups on disk for this many minutes [default: 0 (off)]\n")
+  sys.stderr.write("--refresh-cache : Ignore any cached lookups and fetch them from the cluster\n")
+  sys.stderr.write("--metrics_json= : Append lookup, script and backup events to this file as JSON lines\n")
+  sys.stderr.write("--metrics_prom= : Write the run's timings and API call counts to this file in Prometheus textfile format\n")
+  sys.stderr.write("--validate | --dry-run : Check the options and backup targets without connecting to the Rubrik and exit\n")
+  sys.stderr.write("--profile= : Write cProfile and tracemalloc output for the lookups and the backup loop to prefix.<phase>.prof and prefix.<phase>.mem.txt\n")
   sys.stderr.write("-h | --help : Prints this message\n")
   sys.stderr.write("rubrik : Name or IP of Rubrik\n")
   exit (0)
 
 sla = ""
-backup = ""
+backups = []
+backup_file = ""
+threads = 10
 pre_script = ""
 post_script = ""
-share_id = ""
 fileset = ""
 user = ""
 password = ""
-bu_status_url = ()
-build_fileset = False
 direct_archive = False
-optlist, args = getopt.getopt(sys.argv[1:], 'P:p:s:f:b:c:Dh', ['pre=', 'post=', 'sla=','fileset=', 'backup=', 'creds=', 'direct_archive', 'help'])
+validate = False
+profile_prefix = ""
+cache_ttl = 0
+refresh_cache = False
+poll_min = 5
+poll_max = 300
+metrics_json = ""
+metrics_prom = ""
+optlist, args = getopt.getopt(sys.argv[1:], 'P:p:s:f:b:c:Dh', ['pre=', 'post=', 'sla=','fileset=', 'backup=', 'creds=', 'direct_archive', 'help',
+                                                               'cache_ttl=', 'refresh-cache', 'poll_min=', 'poll_max=',
+                                                               'metrics_json=', 'metrics_prom=', 'backup_file=', 'threads=', 'validate', 'dry-run', 'profile='])
 for opt, a in optlist:
   if opt in ('-P', "--pre"):
     pre_script = a
@@ -72,7 +339,11 @@ for opt, a in optlist:
   if opt in ('-s', "--sla"):
     sla = a
   if opt in ('-b', "--backup"):
-    backup = a
+    backups.append(a)
+  if opt == "--backup_file":
+    backup_file = a
+  if opt == "--threads":
+    threads = int(a)
   if opt in ('-f', "--fileset"):
     fileset = a
   if opt in ('-c', "--creds"):
@@ -82,14 +353,35 @@ for opt, a in optlist:
       (user, password) = get_creds_from_file(a)
   if opt in ('-D', "--direct_archive"):
     direct_archive = True
+  if opt == "--poll_min":
+    poll_min = int(a)
+  if opt == "--poll_max":
+    poll_max = int(a)
+  if opt == "--cache_ttl":
+    cache_ttl = int(a)
+  if opt == "--refresh-cache":
+    refresh_cache = True
+  if opt == "--metrics_json":
+    metrics_json = a
+  if opt == "--metrics_prom":
+    metrics_prom = a
+  if opt in ("--validate", "--dry-run"):
+    validate = True
+  if opt == "--profile":
+    profile_prefix = a
   if opt in ('-h', "--help"):
     usage()
+if validate:
+  exit (validate_run())
 rubrik_cluster = args[0]
-if backup == "":
+targets = [new_target(b) for b in backups]
+if backup_file:
+  targets += read_targets(backup_file)
+if not targets:
   if int(sys.version[0]) < 3:
-    backup = raw_input ("Backup (host:share): ")
+    targets = [new_target(raw_input ("Backup (host:share): "))]
   else:
-    backup = input("Backup (host:share): ")
+    targets = [new_target(input("Backup (host:share): "))]
 if fileset == "":
   if int(sys.version[0]) < 3:
     fileset = raw_input ("Fileset Name: ")
@@ -102,99 +394,72 @@ if user == "":
     user = input("User: ")
 if password == "":
   password = getpass.getpass ("Password: ")
-rubrik = rubrik_cdm.Connect (rubrik_cluster, user, password)
+metrics = rbk_metrics.new_metrics(metrics_json, metrics_prom, "rbk_nas_backup")
+rbk_metrics.event(metrics, 'run_start', cluster=rubrik_cluster, backup=[t['name'] for t in targets], fileset=fileset)
+rubrik = rbk_api.Connect (rubrik_cluster, user, password, pool_size=min(threads, len(targets)))
+profile = rbk_profile.new_profile(profile_prefix)
+rbk_profile.start_phase(profile, 'inventory')
+lookup_start = time.time()
+cache = rbk_cache.load_cache(rubrik_cluster, cache_ttl, refresh_cache)
 version = rubrik.cluster_version().split('.')
 version_maj = int(version[0])
-(host, share) = backup.split(':')
-if share.startswith("/"):
-  share_type = "NFS"
-else:
-  share_type = "SMB"
-hs_data = rubrik.get('internal', '/host/share')
+sla_ids = {}
+template_ids = {}
+hs_index = {}
+hs_data = cached_get(rubrik, cache, 'internal', '/host/share', ('id', 'hostname', 'exportPoint'))
 for x in hs_data['data']:
-  if x['hostname'] == host and x['exportPoint'] == share:
-    share_id = x['id']
-    break
-if share_id == "":
-  sys.stderr.write ("Share not found\n")
-  exit (2)
-fs_data = rubrik.get('v1', str("/fileset?share_id=" + share_id + "&name=" + fileset))
-try:
-  fs_id = fs_data['data'][0]['id']
-except IndexError:
-  template_id = ""
-  fst_data = rubrik.get('v1', str("/fileset_template?share_type=" + share_type + "&name=" + fileset))  
-  for t in fst_data['data']:
-    if t['name'] == fileset:
-      template_id = t['id']
-      break
-  if template_id == "":
-    sys.stderr.write("Fileset not found\n")
-    exit (2)
-  if sla == "":
-    if int(sys.version[0]) < 3:
-      sla_name = raw_input ("SLA Domain: ")
-    else:
-      sla_name = input("SLA Domain: ")
-  else:
-    sla_name = sla
-  sla_data = get_sla_data (rubrik, version_maj, sla_name)
-  try:
-    sla_id = sla_data['data'][0]['id']
-  except IndexError:
-    sys.stderr.write("Can't find SLA: " + sla_name + "\n")
-    exit (2)
-  fs_config = {}
-  fs_config = {"shareId" : str(share_id), "templateId": str(template_id), "slaID" : str(sla_id)}
-  fs_create = rubrik.post('v1', '/fileset', fs_config)
-  fs_id = fs_create['id']
-  build_fileset = True
-if not build_fileset:
-  if sla == "":
-    sla_id = fs_data['data'][0]['configuredSlaDomainId']
-    sla_name = fs_data['data'][0]['configuredSlaDomainName']
-  else:
-    found = False
-    sla_data = get_sla_data (rubrik, version_maj, sla)
-    for s in sla_data['data']:
-      if s['name'] == sla:
-        found = True
-        sla_id = s['id']
-        sla_name = s['name']
-    if not found and version_maj > 4:
-      sla_data = get_sla_data(rubrik, version_maj, sla)
-      for s in sla_data['data']:
-        if s['name'] == sla:
-          found = True
-          sla_id = s['id']
-          sla_name = s['name']
-    if not found:
-      sys.stderr.write ("Can't find SLA: " + sla + "\n")
+  hs_index.setdefault((x['hostname'], x['exportPoint']), x['id'])
+fs_index = None
+if len(targets) > 1:
+  fs_index = {}
+  fs_data = cached_get(rubrik, cache, 'v1', str("/fileset?name=" + fileset),
+                       ('id', 'name', 'shareId', 'configuredSlaDomainId', 'configuredSlaDomainName'))
+  for x in fs_data['data']:
+    if x['name'] == fileset and 'shareId' in x:
+      fs_index.setdefault(x['shareId'], x)
+ready = []
+for t in targets:
+  error = resolve_target(t)
+  if error:
+    if len(targets) == 1:
+      sys.stderr.write (error + "\n")
       exit (2)
-if pre_script:
-  print("Executing " + pre_script)
-  subprocess.call(pre_script, shell=True)
-print("Starting Backup...")
-bu_config = {}
-bu_config = {"slaId" : str(sla_id), "isPassthrough": direct_archive}
-bu_status = rubrik.post ('v1', '/fileset/' + str(fs_id) + "/snapshot", bu_config)
-bu_status_url = str(bu_status['links'][0]['href']).split('/')
-bu_status_path = "/" + "/".join(bu_status_url[5:])
-bu_done = False
-while not bu_done:
-  bu_job_status = rubrik.get ('v1', bu_status_path)
-  print("STATUS: " + str(bu_job_status))
-  bu_status = str(bu_job_status['status'])
-  if bu_status == "RUNNING" or bu_status == "QUEUED" or bu_status == "ACQUIRING" or bu_status == "FINISHING":
-    time.sleep(5)
-  elif bu_status == "SUCCEEDED":
-    bu_done = True
-  elif bu_status == "TO_CANCEL" or 'endTime' in bu_job_status:
-    sys.stderr.write ("Job ended with status: " + str(bu_job_status['status']) + "\n")
-    bu_done = True
+    sys.stderr.write (t['name'] + ": " + error + ". Skipping\n")
+    t['status'] = "NOT_FOUND"
   else:
-    print("Status = " + bu_status)
-    time.sleep(5)
-if post_script and bu_status == "SUCCEEDED":
-  print("Executing " + post_script)
-  subprocess.call (post_script, shell=True)
+    ready.append(t)
+if not ready:
+  exit (2)
+lookup_time = time.time() - lookup_start
+rbk_metrics.set_value(metrics, 'inventory_load_seconds', round(lookup_time, 3), cluster=rubrik_cluster)
+rbk_metrics.event(metrics, 'inventory', cluster=rubrik_cluster, seconds=round(lookup_time, 3), targets=len(ready),
+                  fileset_created=len([t for t in ready if t.get('fileset_created')]))
+rbk_profile.start_phase(profile, 'main_loop')
+pool = ThreadPool(min(threads, len(ready)))
+post_pool = ThreadPool(min(threads, len(ready)))
+running = [t for t in pool.map(start_target, ready) if 'status_path' in t]
+posts = []
+while running:
+  due = [t for t in running if t['next_poll'] <= time.time()]
+  for (t, done) in zip(due, pool.map(poll_target, due)):
+    if done:
+      running.remove(t)
+      posts.append(post_pool.apply_async(finish_target, (t,)))
+  if running:
+    time.sleep(max(min(t['next_poll'] for t in running) - time.time(), 0))
+for p in posts:
+  p.get()
+for p in (pool, post_pool):
+  p.close()
+  p.join()
+rbk_profile.end_phase(profile)
+failed = [t for t in targets if t['status'] != "SUCCEEDED"]
+if len(targets) > 1:
+  print(str(len(targets) - len(failed)) + " of " + str(len(targets)) + " backups succeeded")
+  for t in failed:
+    print("  " + t['name'] + ": " + t['status'])
+rbk_metrics.api_stats(metrics, rubrik.snapshot(), rbk_api.LATENCY_BUCKETS, cluster=rubrik_cluster)
+rbk_metrics.event(metrics, 'run_end', status=targets[0]['status'], succeeded=len(targets) - len(failed), failed=len(failed),
+                  seconds=round(time.time() - metrics['start'], 3))
+rbk_metrics.close_metrics(metrics)
+print(rubrik.summary()[0])
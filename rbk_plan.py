@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import hashlib
+
+# Resolved job plans for rbk_concurrent_nas_backup.py.  A plan is the input file compiled once against
+# the cluster inventory: every line's host-share, SLA, fileset and template IDs, the per-cluster default
+# template ID, a digest of the input file and the options that shaped the resolution, and a fingerprint
+# of each cluster's inventory (version and object counts).  Running from a plan skips the inventory load
+# and resolution entirely; the caller only re-resolves the jobs whose IDs the cluster later rejects.
+
+PLAN_VERSION = 1
+JOB_FIELDS = ('host', 'share', 'cluster', 'hs_id', 'sla_id', 'fs_id', 'fst_id', 'sla', 'pre', 'post')
+
+def input_digest(infile):
+    digest = hashlib.sha1()
+    with open(infile, 'rb') as fp:
+        for block in iter(lambda: fp.read(1048576), b''):
+            digest.update(block)
+    return(digest.hexdigest())
+
+def fingerprint(rubrik, endpoints, timeout=15):
+    fp = {'version': rubrik.cluster_version()}
+    for (name, api, endpoint) in endpoints:
+        if '?' in endpoint:
+            sep = '&'
+        else:
+            sep = '?'
+        fp[name] = rubrik.get(api, endpoint + sep + "limit=1", timeout=timeout).get('total')
+    return(fp)
+
+def new_plan(infile, options, clusters):
+    return({'version': PLAN_VERSION, 'created': round(time.time()), 'input': infile, 'input_sha1': input_digest(infile),
+            'options': options, 'clusters': clusters, 'fields': list(JOB_FIELDS), 'jobs': []})
+
+def add_jobs(plan, jobs):
+    for j in jobs:
+        plan['jobs'].append([j.get(f, "") for f in JOB_FIELDS])
+    return
+
+def plan_jobs(plan):
+    fields = plan['fields']
+    for row in plan['jobs']:
+        j = dict(zip(fields, row))
+        j['planned'] = True
+        yield(j)
+
+def write_plan(plan_file, plan):
+    tmp_file = plan_file + ".tmp"
+    with open(tmp_file, 'w') as fp:
+        json.dump(plan, fp, separators=(',', ':'))
+    os.rename(tmp_file, plan_file)
+    return
+
+def read_plan(plan_file):
+    with open(plan_file) as fp:
+        plan = json.load(fp)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError("unsupported plan version " + str(plan.get('version')))
+    return(plan)
+
+def plan_problems(plan, infile, options, cluster_names):
+    problems = []
+    if plan['input_sha1'] != input_digest(infile):
+        problems.append(infile + " has changed")
+    for k in sorted(options):
+        if plan['options'].get(k) != options[k]:
+            problems.append("--" + k + " differs from the plan")
+    for name in plan['clusters']:
+        if name not in cluster_names:
+            problems.append("cluster " + name + " is not in this run")
+    for name in cluster_names:
+        if name not in plan['clusters']:
+            problems.append("cluster " + name + " is not in the plan")
+    return(problems)
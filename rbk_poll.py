@@ -0,0 +1,60 @@
+import time
+from datetime import datetime
+
+# Adaptive status polling shared by rbk_nas_backup.py and rbk_concurrent_nas_backup.py.  A job is
+# polled at poll_min right after launch and while it is queued or finishing.  While it is RUNNING the
+# interval doubles up to poll_max, capped by an ETA estimate from the job's reported progress so the
+# polls bunch up near completion.  A status call that fails is retried with a doubling delay, and the
+# job is given up on after POLL_FAILURES failures in a row or at once when the cluster answers with a
+# 4xx other than 429, since its status can't be read again.  A finished job's run time is taken from
+# the startTime and endTime in its status, so it doesn't depend on how often it was polled.
+
+POLL_FAILURES = 5
+
+def new_poll_state(poll_min):
+    return({'start': time.time(), 'run_start': 0, 'interval': poll_min, 'failures': 0})
+
+def status_duration(status_data):
+    try:
+        start = datetime.strptime(status_data['startTime'][:19], "%Y-%m-%dT%H:%M:%S")
+        end = datetime.strptime(status_data['endTime'][:19], "%Y-%m-%dT%H:%M:%S")
+    except (KeyError, TypeError, ValueError):
+        return(None)
+    return((end - start).total_seconds())
+
+def poll_failed(poll_state, error_status, poll_min, poll_max):
+    poll_state['failures'] += 1
+    if poll_state['failures'] >= POLL_FAILURES or (400 <= error_status < 500 and error_status != 429):
+        return(None)
+    return(min(poll_min * 2 ** poll_state['failures'], poll_max))
+
+def get_progress(status_data):
+    try:
+        progress = float(status_data['progress'])
+    except (KeyError, TypeError, ValueError):
+        return(None)
+    if progress <= 0 or progress >= 100:
+        return(None)
+    return(progress)
+
+def estimate_eta(poll_state, status_data):
+    progress = get_progress(status_data)
+    if progress is None or not poll_state['run_start']:
+        return(None)
+    elapsed = time.time() - poll_state['run_start']
+    return(elapsed * (100 - progress) / progress)
+
+def next_poll_interval(poll_state, status_data, poll_min, poll_max):
+    if status_data.get('status') != "RUNNING":
+        poll_state['interval'] = poll_min
+        return(poll_min)
+    if not poll_state['run_start']:
+        poll_state['run_start'] = time.time()
+        interval = poll_min
+    else:
+        interval = min(poll_state['interval'] * 2, poll_max)
+    eta = estimate_eta(poll_state, status_data)
+    if eta is not None:
+        interval = min(interval, max(eta / 2, poll_min))
+    poll_state['interval'] = interval
+    return(interval)
@@ -0,0 +1,55 @@
+import sys
+import time
+import cProfile
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Phase profiling for rbk_nas_backup.py and rbk_concurrent_nas_backup.py --profile.  Each phase the
+# script marks (inventory load, job queue generation, main loop) is run under cProfile and, where the
+# Python has it, tracemalloc.  It writes <prefix>.<phase>.prof, which pstats, snakeviz and the like can
+# read, and <prefix>.<phase>.mem.txt with the peak traced memory and the top allocating lines.  cProfile
+# only sees the thread that started the phase, so time spent in worker pools shows up as waits on them.
+# With no prefix every call is a no-op.
+
+TOP_LINES = 25
+
+def new_profile(prefix=""):
+    return({'prefix': prefix, 'phase': None, 'profiler': None, 'start': 0})
+
+def start_phase(profile, name):
+    if not profile['prefix']:
+        return
+    end_phase(profile)
+    profile['phase'] = name
+    profile['start'] = time.time()
+    if tracemalloc:
+        tracemalloc.start()
+    profile['profiler'] = cProfile.Profile()
+    profile['profiler'].enable()
+    return
+
+def end_phase(profile):
+    if profile['phase'] is None:
+        return
+    profile['profiler'].disable()
+    elapsed = time.time() - profile['start']
+    base = profile['prefix'] + "." + profile['phase']
+    profile['profiler'].dump_stats(base + ".prof")
+    line = "PROFILE " + profile['phase'] + ": " + str(round(elapsed, 3)) + "s"
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_LINES]
+        tracemalloc.stop()
+        with open(base + ".mem.txt", 'w') as fp:
+            fp.write("phase: " + profile['phase'] + "\n")
+            fp.write("seconds: " + str(round(elapsed, 3)) + "\n")
+            fp.write("peak_traced_mb: " + str(round(peak / 1048576.0, 2)) + "\n\n")
+            for stat in top:
+                fp.write(str(stat) + "\n")
+        line += ", peak " + str(round(peak / 1048576.0, 1)) + " MB"
+    sys.stderr.write(line + " (" + base + ".prof)\n")
+    profile['phase'] = None
+    profile['profiler'] = None
+    return
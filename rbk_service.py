@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+
+# Local control API for rbk_concurrent_nas_backup.py --serve.  The script keeps its Rubrik sessions,
+# inventory and scheduler running and this module takes backup requests over HTTP on a local TCP port
+# or a Unix socket:
+#
+#   POST /jobs           {"host": ..., "share": ..., "sla": ..., "fileset": ..., "pre": ..., "post": ...} or a list of them
+#   GET  /jobs           every job submitted since the service started
+#   GET  /jobs/<handle>  one job
+#   GET  /status         scheduler state
+#   POST /shutdown       stop taking jobs, finish the running ones and exit
+#
+# Each accepted job gets a handle that stays valid for the life of the service.  The job table only
+# holds records; the script does the resolving, launching and polling through the callbacks it passes in.
+#
+# There is no authentication, so the server only listens on a loopback address or on a Unix socket
+# that only its owner can open.
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+def new_job_table():
+    return({'lock': threading.Lock(), 'jobs': {}, 'next': 1, 'closing': False})
+
+def add_job(table, job):
+    with table['lock']:
+        handle = str(table['next'])
+        table['next'] += 1
+        table['jobs'][handle] = {'handle': handle, 'host': job['host'], 'share': job['share'], 'cluster': job.get('cluster', ""),
+                                 'status': "PENDING", 'job_id': "", 'submitted': time.time(), 'started': None, 'finished': None}
+    job['handle'] = handle
+    return(handle)
+
+def update_job(table, handle, status, job_id="", finished=False):
+    with table['lock']:
+        record = table['jobs'].get(handle)
+        if not record:
+            return
+        record['status'] = status
+        if job_id:
+            record['job_id'] = job_id
+            if not record['started']:
+                record['started'] = time.time()
+        if finished:
+            record['finished'] = time.time()
+    return
+
+def get_jobs(table, handle=None):
+    with table['lock']:
+        if handle is None:
+            return([dict(r) for r in table['jobs'].values()])
+        record = table['jobs'].get(handle)
+        if record:
+            return(dict(record))
+        return(None)
+
+class ControlHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        return
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return(self.client_address[0])
+        return("local")
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        table = self.server.job_table
+        path = self.path.rstrip('/')
+        if path == '/jobs':
+            self.reply(200, get_jobs(table))
+        elif path.startswith('/jobs/'):
+            record = get_jobs(table, path[len('/jobs/'):])
+            if record:
+                self.reply(200, record)
+            else:
+                self.reply(404, {'error': "No such job"})
+        elif path == '/status':
+            self.reply(200, self.server.status())
+        else:
+            self.reply(404, {'error': "Not found"})
+
+    def do_POST(self):
+        table = self.server.job_table
+        path = self.path.rstrip('/')
+        if path == '/shutdown':
+            self.server.shutdown_service()
+            self.reply(200, {'status': "shutting down"})
+            return
+        if path != '/jobs':
+            self.reply(404, {'error': "Not found"})
+            return
+        if table['closing']:
+            self.reply(503, {'error': "Service is shutting down"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            items = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            self.reply(400, {'error': "Body must be JSON"})
+            return
+        single = isinstance(items, dict)
+        if single:
+            items = [items]
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            self.reply(400, {'error': "Body must be a job or a list of jobs"})
+            return
+        try:
+            results = self.server.submit(items)
+        except Exception as e:
+            self.reply(500, {'error': "Can't submit jobs: " + str(e)})
+            return
+        code = 202
+        if all('error' in r for r in results):
+            code = 400
+        if single:
+            self.reply(code, results[0])
+        else:
+            self.reply(code, results)
+
+def split_address(address):
+    if ':' in address:
+        return(address.rsplit(':', 1))
+    return('127.0.0.1', address)
+
+def address_error(address):
+    if '/' in address:
+        return("")
+    (host, port) = split_address(address)
+    if not port.isdigit():
+        return("bad port: " + port)
+    if host != 'localhost' and not host.startswith('127.'):
+        return("won't listen on " + host + ".  The service has no authentication so it only listens on a loopback address or a Unix socket")
+    return("")
+
+def start_server(address, job_table, submit, status, shutdown):
+    error = address_error(address)
+    if error:
+        raise ValueError(error)
+    if '/' in address:
+        if os.path.exists(address):
+            os.remove(address)
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixServer(address, ControlHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(address, 0o600)
+    else:
+        (host, port) = split_address(address)
+        server = ThreadingHTTPServer((host, int(port)), ControlHandler)
+    server.job_table = job_table
+    server.submit = submit
+    server.status = status
+    server.shutdown_service = shutdown
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return(server)
+
+def stop_server(server, address):
+    server.shutdown()
+    server.server_close()
+    if '/' in address and os.path.exists(address):
+        os.remove(address)
+    return